@@ -51,4 +51,60 @@ __all__ = (
     *context.__all__,
     *registry.__all__,
     *digraph.__all__,
-)
\ No newline at end of file
+)
+
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    pass # Numerical modules are only available with numpy
+else:
+    from .compact import *
+    from .incidence import *
+    from .decomposition import *
+    from .evaluation import *
+    from .solver import *
+    from .compiler import *
+    from .jacobian import *
+    from .coloring import *
+    from .properties import *
+    from .scheduler import *
+    from .sweep import *
+    
+    from . import compact
+    from . import incidence
+    from . import decomposition
+    from . import evaluation
+    from . import solver
+    from . import compiler
+    from . import jacobian
+    from . import coloring
+    from . import properties
+    from . import scheduler
+    from . import sweep
+    
+    __all__ = (
+        *__all__,
+        'compact',
+        'incidence',
+        'decomposition',
+        'evaluation',
+        'solver',
+        'compiler',
+        'jacobian',
+        'coloring',
+        'properties',
+        'scheduler',
+        'sweep',
+        *compact.__all__,
+        *incidence.__all__,
+        *decomposition.__all__,
+        *evaluation.__all__,
+        *solver.__all__,
+        *compiler.__all__,
+        *jacobian.__all__,
+        *coloring.__all__,
+        *properties.__all__,
+        *scheduler.__all__,
+        *sweep.__all__,
+    )
+    del numpy
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from .decomposition import compressed_rows
+from .jacobian import JacobianFunction
+try:
+    from scipy import sparse
+except ImportError: # pragma: no cover
+    sparse = None
+
+__all__ = ('color_columns', 'FiniteDifferenceJacobian')
+
+def color_columns(rows, columns, shape):
+    """
+    Return a color for each column of a sparsity pattern (in coordinate
+    format) so that columns of the same color do not share any row. Columns
+    are colored greedily in order of decreasing number of nonzeros (Curtis,
+    Powell, and Reid).
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> incidence = phn.MultiStageVLE(n_stages=5).incidence_matrix()
+    >>> colors = phn.color_columns(incidence.rows, incidence.columns, incidence.shape)
+    >>> int(colors.max()) + 1
+    6
+
+    Columns that share a row always have different colors:
+
+    >>> array = incidence.toarray() != 0
+    >>> all([len(set(colors[row].tolist())) == row.sum() for row in array])
+    True
+
+    """
+    n_rows, n_columns = shape
+    rows = np.asarray(rows, dtype=np.intp)
+    columns = np.asarray(columns, dtype=np.intp)
+    indptr, indices = compressed_rows(rows, columns, shape)
+    column_indptr, column_indices = compressed_rows(columns, rows, (n_columns, n_rows))
+    order = np.argsort(-np.diff(column_indptr), kind='stable').tolist()
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    column_indptr = column_indptr.tolist()
+    column_indices = column_indices.tolist()
+    colors = [-1] * n_columns
+    forbidden = [-1] * (n_columns + 1) # Last column that cannot use each color
+    for column in order:
+        for row in column_indices[column_indptr[column]:column_indptr[column + 1]]:
+            for other in indices[indptr[row]:indptr[row + 1]]:
+                color = colors[other]
+                if color != -1: forbidden[color] = column
+        color = 0
+        while forbidden[color] == column: color += 1
+        colors[column] = color
+    return np.array(colors, dtype=np.intp)
+
+
+class FiniteDifferenceJacobian:
+    """
+    Create a FiniteDifferenceJacobian object which approximates the sparse
+    Jacobian of a residual function by forward finite differences. State
+    variables that do not share any residual are perturbed together, so
+    each call only evaluates the residuals once for each color (see
+    `color_columns`) instead of once for each state variable. This also
+    works for equations of black-box functions (e.g., `Function` and
+    `LLECriteria` phenomena), which cannot be differentiated symbolically.
+
+    Parameters
+    ----------
+    residuals : ResidualFunction
+        Compiled residuals of equations.
+    rows, columns : 1d array[int], optional
+        Sparsity pattern of the Jacobian. Defaults to the structural
+        nonzeros of the equations (see `JacobianFunction`), where results
+        of black-box functions depend on all elements of their parameters.
+    step : float, optional
+        Relative step size. Defaults to 1e-6.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> residuals = phn.ResidualFunction(phn.MultiStageVLE(n_stages=5), n_chemicals=2)
+    >>> jacobian = phn.FiniteDifferenceJacobian(residuals)
+    >>> jacobian.shape, jacobian.n_colors
+    ((109, 131), 7)
+
+    Perturbing 7 groups of columns gives the same Jacobian as perturbing 
+    each of the 131 columns separately:
+
+    >>> import numpy as np
+    >>> functions = {
+    ...     'H': lambda F, T, P: F.sum(-1) * (T - 300.),
+    ...     'BubblePoint': lambda z, P: (np.array([2., 0.5]) * P / 101325., 350. + z[0] / z.sum()),
+    ... }
+    >>> residuals = phn.ResidualFunction(phn.MultiStageVLE(n_stages=5), 2, functions=functions)
+    >>> jacobian = phn.FiniteDifferenceJacobian(residuals)
+    >>> x = np.random.default_rng(0).uniform(1., 2., residuals.size)
+    >>> steps = jacobian.step * np.maximum(np.abs(x), 1.)
+    >>> differences = np.array([
+    ...     (residuals(x + h * i) - residuals(x)) / h for h, i in zip(steps, np.eye(x.size))
+    ... ]).T
+    >>> A = jacobian(x)
+    >>> A = A.toarray() if hasattr(A, 'toarray') else A # Sparse with scipy
+    >>> np.allclose(A, differences)
+    True
+
+    """
+    __slots__ = (
+        'residuals', 'rows', 'columns', 'colors', 'groups', 'order',
+        'indptr', 'indices', 'shape', 'step',
+    )
+
+    def __init__(self, residuals, rows=None, columns=None, step=1e-6):
+        if rows is None or columns is None:
+            jacobian = JacobianFunction(residuals)
+            rows = jacobian.rows
+            columns = jacobian.columns
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = np.asarray(columns, dtype=np.intp)
+        shape = (residuals.n_residuals, residuals.size)
+        colors = color_columns(rows, columns, shape)
+        entry_colors = colors[columns]
+        n_colors = int(colors.max()) + 1 if colors.size else 0
+        groups = []
+        for color in range(n_colors):
+            entries = np.flatnonzero(entry_colors == color)
+            groups.append((np.flatnonzero(colors == color), entries))
+        order = np.lexsort((columns, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        self.residuals = residuals
+        self.rows = rows
+        self.columns = columns
+        self.colors = colors
+        self.groups = groups
+        self.order = order
+        self.indptr = indptr
+        self.indices = columns[order]
+        self.shape = shape
+        self.step = step
+
+    @property
+    def n_colors(self):
+        """[int] Number of residual evaluations for each Jacobian (besides
+        the evaluation at the state vector)."""
+        return len(self.groups)
+
+    @property
+    def nnz(self):
+        """[int] Number of structural nonzeros."""
+        return self.rows.size
+
+    def values(self, x, residuals=None):
+        """Return the values of nonzero entries (in the order of `rows`
+        and `columns`) at state vector `x`. Residuals at `x` may be given
+        to save one evaluation."""
+        x = np.asarray(x, dtype=float)
+        f = self.residuals
+        if residuals is None: residuals = f(x)
+        steps = self.step * np.maximum(np.abs(x), 1.)
+        rows = self.rows
+        columns = self.columns
+        data = np.empty(self.nnz)
+        for group, entries in self.groups:
+            perturbed = x.copy()
+            perturbed[group] += steps[group]
+            difference = f(perturbed) - residuals
+            data[entries] = difference[rows[entries]] / steps[columns[entries]]
+        return data
+
+    def __call__(self, x, residuals=None):
+        """Return the Jacobian at state vector `x` as a sparse matrix in
+        compressed sparse row format (or a dense array if scipy is not
+        installed)."""
+        data = self.values(x, residuals)
+        if sparse is None:
+            array = np.zeros(self.shape)
+            array[self.rows, self.columns] = data
+            return array
+        return sparse.csr_array((data[self.order], self.indices, self.indptr), shape=self.shape)
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {self.shape[0]} residuals x "
+                f"{self.shape[1]} states, {self.n_colors} colors>")
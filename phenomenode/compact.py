@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+
+__all__ = ('CompactGraph',)
+
+def iter_ports(gate):
+    for port, i in enumerate(gate):
+        if hasattr(i, 'varnodes'):
+            for j in i.varnodes: yield port, j
+        elif hasattr(i, '__iter__'):
+            for j in i: yield port, j
+        else:
+            yield port, i
+
+def frozen(array):
+    array.setflags(write=False)
+    return array
+
+def compressed(rows, columns, ports, size):
+    # Return index pointer, indices, and ports compressed by row.
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(size + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return frozen(indptr), frozen(columns[order]), frozen(ports[order])
+
+def codes(values):
+    # Return names and integer codes (-1 for None) of values.
+    names = []
+    index = {}
+    array = np.empty(len(values), dtype=np.int32)
+    for n, i in enumerate(values):
+        if i is None:
+            array[n] = -1
+        elif i in index:
+            array[n] = index[i]
+        else:
+            array[n] = index[i] = len(names)
+            names.append(i)
+    return tuple(names), frozen(array)
+
+
+class CompactGraph:
+    """
+    Create a read-only CompactGraph object which stores the structure of
+    a phenomenode as integer arrays. Phenomena and variable nodes are given
+    integer ids by order of appearance within the hierarchy. Each role
+    (source or sink) is stored both in compressed sparse row (CSR) format
+    by phenomenon and in compressed sparse column (CSC) format by variable
+    node, together with the port (index of the inlet or outlet) of each
+    connection.
+
+    Parameters
+    ----------
+    phenomenode : PhenomeNode
+        Phenomenode to compact.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> stage = phn.StageVLE()
+    >>> graph = stage.compact_graph()
+    >>> int(graph.select(category=('material', 'material-phenomena')).sum())
+    6
+
+    Rows and columns list the same variable nodes as the gates of each 
+    phenomenon, and parents are the phenomena that hold them:
+
+    >>> graph = phn.MultiStageVLE(n_stages=3).compact_graph()
+    >>> all([
+    ...     [graph.varnodes[j] for j in graph.outlets(i)] == list(phenomenon.outs.varnodes)
+    ...     and [graph.varnodes[j] for j in graph.inlets(i)] == list(phenomenon.ins.varnodes)
+    ...     for i, phenomenon in enumerate(graph.phenomena)
+    ... ])
+    True
+    >>> all([
+    ...     graph.phenomena[i] in varnode.sources
+    ...     for j, varnode in enumerate(graph.varnodes) for i in graph.sources(j)
+    ... ])
+    True
+    >>> all([
+    ...     phenomenon in graph.phenomena[i].phenomena
+    ...     for phenomenon, i in zip(graph.phenomena, graph.parents) if i != -1
+    ... ])
+    True
+
+    """
+    __slots__ = (
+        'phenomenode', 'phenomena', 'varnodes', 'parents', 'flags',
+        'categories', 'category_codes', 'subcategories', 'subcategory_codes',
+        'source_indptr', 'source_indices', 'source_ports',
+        'sink_indptr', 'sink_indices', 'sink_ports',
+        'varnode_source_indptr', 'varnode_source_indices', 'varnode_source_ports',
+        'varnode_sink_indptr', 'varnode_sink_indices', 'varnode_sink_ports',
+    )
+
+    #: [int] Flag bits of phenomena.
+    LEAF = 1
+    DIRECTED = 2
+    UNDIRECTED = 4
+    LINEAR = 8
+    NONLINEAR = 16
+
+    def __init__(self, phenomenode):
+        phenomena = phenomenode.nested_phenomena
+        phenomenon_ids = {j: i for i, j in enumerate(phenomena)}
+        varnode_ids = {}
+        varnodes = []
+        parents = np.full(len(phenomena), -1, dtype=np.intp)
+        flags = np.zeros(len(phenomena), dtype=np.uint8)
+        roles = ([], [], []), ([], [], []) # Rows, columns, and ports of sources and sinks
+        for i, phenomenon in enumerate(phenomena):
+            subphenomena = phenomenon.phenomena
+            if subphenomena:
+                for j in subphenomena: parents[phenomenon_ids[j]] = i
+            else:
+                flags[i] |= self.LEAF
+            directed = phenomenon.directed
+            if directed is not None: flags[i] |= self.DIRECTED if directed else self.UNDIRECTED
+            linear = phenomenon.linear
+            if linear is not None: flags[i] |= self.LINEAR if linear else self.NONLINEAR
+            for gate, (rows, columns, ports) in zip((phenomenon.outs, phenomenon.ins), roles):
+                for port, varnode in iter_ports(gate):
+                    if varnode in varnode_ids:
+                        j = varnode_ids[varnode]
+                    else:
+                        j = varnode_ids[varnode] = len(varnodes)
+                        varnodes.append(varnode)
+                    rows.append(i)
+                    columns.append(j)
+                    ports.append(port)
+        setfield = object.__setattr__
+        setfield(self, 'phenomenode', phenomenode)
+        setfield(self, 'phenomena', phenomena)
+        setfield(self, 'varnodes', tuple(varnodes))
+        setfield(self, 'parents', frozen(parents))
+        setfield(self, 'flags', frozen(flags))
+        categories, category_codes = codes([i.category for i in phenomena])
+        setfield(self, 'categories', categories)
+        setfield(self, 'category_codes', category_codes)
+        subcategories, subcategory_codes = codes([i.subcategory for i in phenomena])
+        setfield(self, 'subcategories', subcategories)
+        setfield(self, 'subcategory_codes', subcategory_codes)
+        n_phenomena = len(phenomena)
+        n_varnodes = len(varnodes)
+        for role, (rows, columns, ports) in zip(('source', 'sink'), roles):
+            rows = np.array(rows, dtype=np.intp)
+            columns = np.array(columns, dtype=np.intp)
+            ports = np.array(ports, dtype=np.intp)
+            indptr, indices, sorted_ports = compressed(rows, columns, ports, n_phenomena)
+            setfield(self, role + '_indptr', indptr)
+            setfield(self, role + '_indices', indices)
+            setfield(self, role + '_ports', sorted_ports)
+            indptr, indices, sorted_ports = compressed(columns, rows, ports, n_varnodes)
+            setfield(self, 'varnode_' + role + '_indptr', indptr)
+            setfield(self, 'varnode_' + role + '_indices', indices)
+            setfield(self, 'varnode_' + role + '_ports', sorted_ports)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("compact graphs are read-only")
+
+    @property
+    def n_phenomena(self):
+        """[int] Number of phenomena."""
+        return len(self.phenomena)
+
+    @property
+    def n_varnodes(self):
+        """[int] Number of variable nodes."""
+        return len(self.varnodes)
+
+    @property
+    def leaves(self):
+        """[1d array[bool]] Whether each phenomenon is a leaf."""
+        return (self.flags & self.LEAF).astype(bool)
+
+    @property
+    def directed(self):
+        """[1d array[bool]] Whether each phenomenon is directed."""
+        return (self.flags & self.DIRECTED).astype(bool)
+
+    @property
+    def linear(self):
+        """[1d array[bool]] Whether each phenomenon is linear."""
+        return (self.flags & self.LINEAR).astype(bool)
+
+    def outlets(self, index):
+        """Return the indices of variable nodes sourced by a phenomenon."""
+        return self.source_indices[self.source_indptr[index]:self.source_indptr[index + 1]]
+
+    def inlets(self, index):
+        """Return the indices of variable nodes sinked by a phenomenon."""
+        return self.sink_indices[self.sink_indptr[index]:self.sink_indptr[index + 1]]
+
+    def sources(self, index):
+        """Return the indices of phenomena that source a variable node."""
+        indptr = self.varnode_source_indptr
+        return self.varnode_source_indices[indptr[index]:indptr[index + 1]]
+
+    def sinks(self, index):
+        """Return the indices of phenomena that sink a variable node."""
+        indptr = self.varnode_sink_indptr
+        return self.varnode_sink_indices[indptr[index]:indptr[index + 1]]
+
+    def select(self, category=None, subcategory=None, directed=None,
+               linear=None, leaves=None):
+        """
+        Return a boolean mask of phenomena that match all given criteria.
+
+        Parameters
+        ----------
+        category : str|Iterable[str], optional
+            Category or categories of phenomena.
+        subcategory : str|Iterable[str], optional
+            Subcategory or subcategories of phenomena.
+        directed : bool, optional
+            Whether phenomena are directed.
+        linear : bool, optional
+            Whether phenomena are linear.
+        leaves : bool, optional
+            Whether phenomena are leaves.
+
+        """
+        flags = self.flags
+        mask = np.ones(flags.size, dtype=bool)
+        if category is not None:
+            mask &= self._isin(self.categories, self.category_codes, category)
+        if subcategory is not None:
+            mask &= self._isin(self.subcategories, self.subcategory_codes, subcategory)
+        if directed is not None:
+            mask &= (flags & (self.DIRECTED if directed else self.UNDIRECTED)).astype(bool)
+        if linear is not None:
+            mask &= (flags & (self.LINEAR if linear else self.NONLINEAR)).astype(bool)
+        if leaves is not None:
+            mask &= (flags & self.LEAF).astype(bool) == leaves
+        return mask
+
+    @staticmethod
+    def _isin(names, codes, values):
+        if isinstance(values, str): values = (values,)
+        selected = [names.index(i) for i in values if i in names]
+        return np.isin(codes, selected)
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {self.n_phenomena} phenomena, "
+                f"{self.n_varnodes} variable nodes>")
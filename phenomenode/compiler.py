@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from numbers import Number
+from .variable import Variable, FunctionCall, index as I
+from .context import ContextStack
+from .quantity import Quantities
+from .term import Term
+from .evaluation import is_reduction, flatten, get_variables
+
+__all__ = ('ResidualFunction', 'AssignmentCompiler')
+
+operators = {
+    '+': '+',
+    '-': '-',
+    '·': '*',
+    '/': '/',
+    '^': '**',
+}
+
+def has_family(variable, family):
+    context = variable.context
+    if isinstance(context, ContextStack):
+        return family in context.stack
+    else:
+        return context is family
+
+def default_shape(variable, n_chemicals):
+    # Variables of phases in general (e.g., feeds) are stored as totals by
+    # chemical, so that they add up with phase-specific variables.
+    return (n_chemicals,) if has_family(variable, I.chemicals) else ()
+
+def unwrap(quantity):
+    if isinstance(quantity, (list, tuple)) and len(quantity) == 1:
+        return quantity[0]
+    else:
+        return quantity
+
+
+def has_callback(quantity):
+    quantity = unwrap(quantity)
+    if isinstance(quantity, Term):
+        return has_callback(quantity.left) or has_callback(quantity.right)
+    elif isinstance(quantity, FunctionCall):
+        return (quantity.function.name not in ('Σ', 'Π', 'min') 
+                or any([has_callback(i) for i in flatten(quantity.parameters)]))
+    else:
+        return False
+
+def batch(functions, name, calls, scenarios=()):
+    # Evaluate all calls of a function at once if the function supports
+    # batches (e.g., functions of property packages). Parameters of batches
+    # of scenarios have a trailing axis of scenarios; each scenario is a
+    # separate call and values are stacked along a trailing axis.
+    function = functions[name]
+    if scenarios:
+        n = scenarios[0]
+        calls = [tuple([i[..., k] if np.ndim(i) else i for i in call])
+                 for call in calls for k in range(n)]
+    if hasattr(function, 'batch'):
+        values = function.batch(calls)
+    else:
+        values = [function(*i) for i in calls]
+    if scenarios:
+        values = [stack(values[i:i + n]) for i in range(0, len(values), n)]
+    return values
+
+def stack(values):
+    if isinstance(values[0], tuple):
+        return tuple([np.stack(i, axis=-1) for i in zip(*values)])
+    else:
+        return np.stack(values, axis=-1)
+
+def trailing(value, ndim, scenarios):
+    # Move the leading axis of scenarios of a value (if any) to the end, or
+    # repeat the value for each scenario.
+    if np.ndim(value) > ndim:
+        return np.moveaxis(np.asarray(value), 0, -1)
+    elif scenarios:
+        shape = np.shape(value)
+        return np.broadcast_to(np.reshape(value, shape + (1,) * len(scenarios)), shape + scenarios)
+    else:
+        return value
+
+def leading(value, ndim):
+    # Move the trailing axis of scenarios of a value (if any) to the front.
+    if np.ndim(value) > ndim:
+        return np.moveaxis(value, -1, 0)
+    else:
+        return value
+
+def scale(linear, factor, operator):
+    coefficients, constant = linear
+    return ({i: f"({j} {operator} {factor})" for i, j in coefficients.items()}, 
+            f"({constant} {operator} {factor})")
+
+def combine(left, right, operator):
+    coefficients = left[0].copy()
+    for i, j in right[0].items():
+        if i in coefficients:
+            coefficients[i] = f"({coefficients[i]} {operator} {j})"
+        else:
+            coefficients[i] = j if operator == '+' else f"(-{j})"
+    return coefficients, f"({left[1]} {operator} {right[1]})"
+
+def broadcast_shapes(shapes):
+    shapes = [i for i in shapes if i is not None]
+    return np.broadcast_shapes(*shapes) if shapes else None
+
+def state_source(variables, shapes, fixed):
+    # Return local names of variables and source code that loads them
+    # from the state vector and parameters. States of several scenarios are
+    # given as rows, so that after transposing, each variable has a
+    # trailing axis of scenarios which broadcasts with all other variables.
+    names = {}
+    lines = [
+        "    x = x.T",
+        "    B = x.shape[1:]",
+        "    axis = -1 - len(B)",
+    ]
+    start = 0
+    for n, variable in enumerate(variables):
+        shape = shapes[variable]
+        end = start + int(np.prod(shape))
+        names[variable] = name = f"x{n}"
+        if len(shape) > 1:
+            lines.append(f"    {name} = x[{start}:{end}].reshape({shape!r} + B)")
+        elif shape:
+            lines.append(f"    {name} = x[{start}:{end}]")
+        else:
+            lines.append(f"    {name} = x[{start}]")
+        start = end
+    for n, variable in enumerate(fixed):
+        names[variable] = name = f"p{n}"
+        lines.append(f"    {name} = p[{n}]")
+    return names, lines
+
+
+class ResidualCompiler:
+    # Generates Python source code of residual functions.
+    __slots__ = ('names', 'shapes', 'lines', 'calls', 'batches', 'size')
+
+    def __init__(self, names, shapes, lines):
+        self.names = names # Local names of variables
+        self.shapes = shapes # Shapes of variables
+        self.lines = lines
+        self.calls = {} # Local names of function calls by source
+        self.batches = {} # Local names and parameters of batched calls by function name
+        self.size = 0 # Number of residuals
+
+    def temporary(self, source):
+        calls = self.calls
+        if source in calls: return calls[source]
+        name = calls[source] = f"_{len(calls)}"
+        self.lines.append(f"    {name} = {source}")
+        return name
+
+    def batched(self, name, source, parameters):
+        calls = self.calls
+        if source in calls: return calls[source]
+        local = calls[source] = f"_{len(calls)}"
+        if name in self.batches:
+            self.batches[name].append((local, parameters))
+        else:
+            self.batches[name] = [(local, parameters)]
+        return local
+
+    def call(self, name, parameters):
+        comma = ',' if len(parameters) == 1 else ''
+        return self.temporary(
+            f"batch(functions, {name!r}, (({', '.join(parameters)}{comma}),), B)[0]"
+        )
+
+    def batch_lines(self):
+        # Return the source code of batched function calls, which only
+        # depend on variables and therefore may be evaluated first.
+        lines = []
+        for name, calls in self.batches.items():
+            names = ', '.join([i for i, j in calls])
+            parameters = ', '.join([f"({', '.join(j)}{',' if len(j) == 1 else ''})" for i, j in calls])
+            lines.append(f"    {names}, = batch(functions, {name!r}, ({parameters},), B)")
+        return lines
+
+    def expression(self, quantity):
+        quantity = unwrap(quantity)
+        if isinstance(quantity, Variable):
+            return self.names[quantity]
+        elif isinstance(quantity, Term):
+            left = self.expression(quantity.left)
+            right = self.expression(quantity.right)
+            try:
+                operator = operators[quantity.operator]
+            except KeyError:
+                raise ValueError(f"invalid operator {quantity.operator!r}") from None
+            return f"({left} {operator} {right})"
+        elif isinstance(quantity, FunctionCall):
+            function = quantity.function
+            name = function.name
+            parameters = [self.expression(i) for i in flatten(quantity.parameters)]
+            if name == 'Σ':
+                if is_reduction(function):
+                    parameters = [f"np.sum({i}, axis=axis)" for i in parameters]
+                return f"({' + '.join(parameters)})"
+            elif name == 'Π':
+                if is_reduction(function):
+                    parameters = [f"np.prod({i}, axis=axis)" for i in parameters]
+                return f"({' * '.join(parameters)})"
+            elif name == 'min' and len(parameters) == 1:
+                return parameters[0]
+            elif name == 'min':
+                return f"np.minimum.reduce([{', '.join(parameters)}])"
+            else:
+                if any([has_callback(i) for i in flatten(quantity.parameters)]):
+                    return self.call(name, parameters)
+                else:
+                    source = f"functions[{name!r}]({', '.join(parameters)})"
+                    return self.batched(name, source, parameters)
+        elif isinstance(quantity, Number):
+            return repr(quantity)
+        else:
+            raise TypeError(f"cannot compile {type(quantity).__name__!r} objects")
+
+    def shape(self, quantity):
+        # Return the shape of a quantity (None if unknown).
+        quantity = unwrap(quantity)
+        if isinstance(quantity, Variable):
+            return self.shapes[quantity]
+        elif isinstance(quantity, Term):
+            return broadcast_shapes([self.shape(quantity.left), self.shape(quantity.right)])
+        elif isinstance(quantity, FunctionCall):
+            function = quantity.function
+            if function.name not in ('Σ', 'Π', 'min'): return None # Callback
+            shapes = [self.shape(i) for i in flatten(quantity.parameters)]
+            if function.name != 'min' and is_reduction(function):
+                shapes = [None if i is None else i[:-1] for i in shapes]
+            return broadcast_shapes(shapes)
+        else:
+            return ()
+
+    def residual(self, left, right, index=None):
+        # Add the source code of the residual of left - right (or the 
+        # index-th value of right for functions with several values).
+        if index is None:
+            source = f"{self.expression(left)} - {self.expression(right)}"
+            shape = broadcast_shapes([self.shape(left), self.shape(right)]) or ()
+        else:
+            source = f"{self.expression(left)} - {self.values(right)}[{index}]"
+            shape = self.shape(left)
+        start = self.size
+        end = self.size = start + int(np.prod(shape))
+        if len(shape) > 1:
+            self.lines.append(f"    r[{start}:{end}] = np.reshape({source}, (-1, *B))")
+        elif shape:
+            self.lines.append(f"    r[{start}:{end}] = {source}")
+        else:
+            self.lines.append(f"    r[{start}] = {source}")
+
+    def equation(self, equation):
+        # Add the source code of each residual of an equation.
+        left, right = [unwrap(i) for i in equation.terms]
+        if isinstance(left, (Quantities, list, tuple)):
+            left, right = right, left
+        if isinstance(right, Quantities): right = right.quantities
+        if isinstance(right, (list, tuple)):
+            for i, j in enumerate(right): self.residual(j, left, i)
+        else:
+            self.residual(left, right)
+
+    def values(self, quantity):
+        # Return the local name of a quantity with several values.
+        source = self.expression(quantity)
+        if source not in self.calls.values(): source = self.temporary(source)
+        return source
+
+
+class AssignmentCompiler(ResidualCompiler):
+    """
+    Create an AssignmentCompiler object which generates the Python source 
+    code of a function `f(values, functions, B)` that evaluates expressions
+    at values by variable. Assignments store values of target variables 
+    and linear forms return the source code of coefficients and constants
+    of equations that are linear with respect to unknown variables. Function
+    calls are evaluated where they appear (instead of in batches up front)
+    because their parameters may depend on earlier assignments.
+    
+    Parameters
+    ----------
+    scenarios : bool, optional
+        Whether values may have a leading axis of scenarios, which is moved
+        to the end while evaluating (see `EvaluationPlan.evaluate_batch`).
+        Defaults to False.
+    
+    """
+    __slots__ = ('variables', 'loaded', 'scenarios')
+
+    def __init__(self, scenarios=False):
+        super().__init__({}, {}, ["    axis = -1 - len(B)"])
+        self.variables = {} # Indices of variables in V
+        self.loaded = [] # Variables loaded from values
+        self.scenarios = scenarios
+
+    def batched(self, name, source, parameters):
+        return self.call(name, parameters)
+
+    def index(self, variable):
+        variables = self.variables
+        if variable not in variables: variables[variable] = len(variables)
+        return variables[variable]
+
+    def load(self, quantity, unknowns=()):
+        # Add the source code that loads the values of all (known) variables
+        # of a quantity.
+        names = self.names
+        lines = self.lines
+        for variable in get_variables(quantity):
+            if variable in names or variable in unknowns: continue
+            names[variable] = name = f"v{len(names)}"
+            value = f"values[V[{self.index(variable)}]]"
+            if self.scenarios:
+                ndim = len(default_shape(variable, 0))
+                value = f"trailing({value}, {ndim}, B)"
+            lines.append(f"    {name} = {value}")
+            self.loaded.append(variable)
+
+    def assign(self, targets, expression):
+        # Add the source code that evaluates an expression and stores its
+        # value(s) in the target variables.
+        names = self.names
+        lines = self.lines
+        self.load(expression)
+        expression = unwrap(expression)
+        if isinstance(expression, Quantities): expression = expression.quantities
+        if isinstance(expression, (list, tuple)):
+            source = f"({', '.join([self.expression(i) for i in expression])},)"
+        else:
+            source = self.expression(expression)
+        local_names = []
+        for variable in targets:
+            if variable not in names: names[variable] = f"v{len(names)}"
+            local_names.append(names[variable])
+        if len(targets) == 1:
+            lines.append(f"    {local_names[0]} = {source}")
+        else:
+            lines.append(f"    {', '.join(local_names)} = {source}")
+        for variable in targets:
+            value = names[variable]
+            if self.scenarios:
+                ndim = len(default_shape(variable, 0))
+                value = f"leading({value}, {ndim})"
+            lines.append(f"    values[V[{self.index(variable)}]] = {value}")
+
+    def linear(self, quantity, unknowns):
+        # Return the source code of the coefficients of unknown variables
+        # (by index) and of the constant of a quantity that is linear with 
+        # respect to the unknowns.
+        self.load(quantity, unknowns)
+        return self.linear_form(quantity, unknowns)
+
+    def linear_form(self, quantity, unknowns):
+        quantity = unwrap(quantity)
+        if not any([i in unknowns for i in get_variables(quantity)]):
+            return {}, self.expression(quantity)
+        elif isinstance(quantity, Variable):
+            return {unknowns[quantity]: '1'}, '0'
+        elif isinstance(quantity, Term):
+            operator = quantity.operator
+            left = self.linear_form(quantity.left, unknowns)
+            right = self.linear_form(quantity.right, unknowns)
+            if operator == '+' or operator == '-':
+                return combine(left, right, operator)
+            elif operator == '·':
+                if not left[0]:
+                    return scale(right, left[1], '*')
+                elif not right[0]:
+                    return scale(left, right[1], '*')
+            elif operator == '/':
+                if not right[0]: return scale(left, right[1], '/')
+        elif isinstance(quantity, FunctionCall):
+            function = quantity.function
+            if function.name == 'Σ' and not is_reduction(function):
+                linear = ({}, '0')
+                for i in flatten(quantity.parameters):
+                    linear = combine(linear, self.linear_form(i, unknowns), '+')
+                return linear
+        else:
+            raise TypeError(f"cannot linearize {type(quantity).__name__!r} objects")
+        raise ValueError(f"{quantity} is not linear with respect to the unknowns")
+
+    def compile(self, name, lines=(), filename=None):
+        # Return a function of the source code compiled so far, followed 
+        # by the given lines.
+        source = '\n'.join([
+            f"def {name}(values, functions, B):",
+            *self.lines,
+            *lines,
+        ])
+        namespace = {
+            'np': np, 'batch': batch, 'trailing': trailing, 'leading': leading,
+            'V': tuple(self.variables),
+        }
+        exec(compile(source, filename or f"<{name}>", 'exec'), namespace)
+        return source, namespace[name]
+
+
+class ResidualFunction:
+    """
+    Create a ResidualFunction object which compiles the equations of all
+    leaf phenomena of a phenomenode into a single Python function of a flat
+    state vector. Variables by chemical are array slices of the state
+    vector, sums over chemicals are compiled into reductions along the last
+    axis, and other functions (e.g., 'H', 'C', 'BubblePoint') are callbacks
+    looked up by name on each call. All calls of the same callback are
+    evaluated together, in a single batch if the callback supports it
+    (see `PropertyPackage`). Residuals of all equations are written
+    into a single flat array; shapes of residuals are inferred from the
+    shapes of variables, and callbacks are assumed to return values that
+    broadcast with the other side of their equations.
+
+    Several scenarios (e.g., feed and operating conditions) are evaluated
+    in a single call by passing a 2d array with one state vector per row.
+    Parameters may also be given with a leading axis of scenarios. Each
+    scenario is a separate call of callbacks, so all calls of a callback
+    across scenarios are evaluated in a single batch.
+
+    Parameters
+    ----------
+    phenomenode : PhenomeNode
+        Phenomenode with leaf phenomena.
+    n_chemicals : int
+        Number of chemicals.
+    parameters : Mapping[Variable, float|ndarray], optional
+        Values of framed variables which are specified and therefore
+        excluded from the state vector.
+    functions : Mapping[str, Callable], optional
+        Functions by name.
+    shapes : Mapping[Variable, tuple[int]], optional
+        Shapes of variables. Defaults to (n_chemicals,) for variables by
+        chemical and () otherwise.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import phenomenode as phn
+    >>> f = phn.ResidualFunction(phn.StageVLE(), n_chemicals=2)
+    >>> f.size, f.n_residuals
+    (37, 24)
+    >>> f.pack({i: np.ones((3, *f.shapes[i])) for i in f.variables}).shape
+    (3, 37)
+
+    Residuals are in order of equations and match a direct evaluation,
+    as in the pressure (first) and material balance (seventh) equations
+    of a mixer:
+
+    >>> functions = {
+    ...     'H': lambda F, T, P: F.sum(-1) * (T - 300.),
+    ...     'C': lambda F, T, P: F.sum(-1),
+    ... }
+    >>> f = phn.ResidualFunction(phn.Mixer(), 2, functions=functions)
+    >>> print(f.equations[0])
+    min(P[i=0], P[i=1]) = P[o=0]
+    >>> x = np.random.default_rng(0).uniform(1., 2., f.size)
+    >>> values = f.unpack(x)
+    >>> F0, F1, F2 = [values[i] for i in f.variables if i.name == 'F']
+    >>> P0, P1, P2 = [values[i] for i in f.variables if i.name == 'P']
+    >>> r = f(x)
+    >>> bool(r[0] == min(P0, P1) - P2), np.allclose(r[6:8], F2 - F0 - F1)
+    (True, True)
+    
+    Each row of a batch of scenarios is evaluated as a separate state:
+    
+    >>> np.allclose(f(np.stack([x, 2 * x])), [f(x), f(2 * x)])
+    True
+
+    """
+    __slots__ = (
+        'phenomenode', 'parameters', 'functions', 'equations', 'variables',
+        'fixed', 'shapes', 'slices', 'size', 'n_residuals', 'source', 'function',
+    )
+
+    def __init__(self, phenomenode, n_chemicals, parameters=None, functions=None, shapes=None):
+        phenomena = phenomenode.leaf_phenomena or (phenomenode,)
+        equations = tuple([j for i in phenomena for j in i.equations()])
+        parameters = {} if parameters is None else dict(parameters)
+        all_variables = tuple({j: None for i in equations for j in get_variables(i.terms)})
+        variables = tuple([i for i in all_variables if i not in parameters])
+        fixed = tuple([i for i in all_variables if i in parameters])
+        if shapes is None: shapes = {}
+        shapes = {i: tuple(shapes[i]) if i in shapes else default_shape(i, n_chemicals)
+                  for i in all_variables}
+        slices = {}
+        start = 0
+        for variable in variables:
+            end = start + int(np.prod(shapes[variable]))
+            slices[variable] = slice(start, end)
+            start = end
+        names, lines = state_source(variables, shapes, fixed)
+        compiler = ResidualCompiler(names, shapes, lines)
+        header = len(lines)
+        for i in equations: compiler.equation(i)
+        source = '\n'.join([
+            "def residuals(x, p, functions, r):",
+            *lines[:header],
+            *compiler.batch_lines(),
+            *lines[header:],
+            "    return r",
+        ])
+        namespace = {'np': np, 'batch': batch}
+        exec(compile(source, f"<residuals of {phenomenode}>", 'exec'), namespace)
+        self.phenomenode = phenomenode
+        self.parameters = parameters
+        self.functions = {} if functions is None else dict(functions)
+        self.equations = equations
+        self.variables = variables
+        self.fixed = fixed
+        self.shapes = shapes
+        self.slices = slices
+        self.size = start
+        self.n_residuals = compiler.size
+        self.source = source
+        self.function = namespace['residuals']
+
+    def parameter_values(self, scenarios=()):
+        """Return the values of parameters in order of appearance. Given
+        the shape of a batch of scenarios, values have a trailing axis of
+        scenarios instead."""
+        parameters = self.parameters
+        shapes = self.shapes
+        try:
+            return [trailing(parameters[i], len(shapes[i]), scenarios) for i in self.fixed]
+        except KeyError as error:
+            raise KeyError(f"no value for parameter {error.args[0]}") from None
+
+    def __call__(self, x):
+        """Return the residuals of all equations at state vector `x`, or
+        a 2d array of residuals at each row of a 2d array of state
+        vectors (one row per scenario)."""
+        x = np.asarray(x, dtype=float)
+        scenarios = x.shape[:-1]
+        if len(scenarios) > 1: raise ValueError('state vectors must be a 1d or 2d array')
+        return self.function(
+            x, self.parameter_values(scenarios), self.functions,
+            np.empty((self.n_residuals, *scenarios))
+        ).T
+
+    def pack(self, values):
+        """Return the state vector of a mapping of values by variable, or
+        a 2d array of state vectors (one row per scenario) if any value has
+        a leading axis of scenarios."""
+        shapes = self.shapes
+        arrays = {}
+        scenarios = ()
+        for variable in self.slices:
+            try:
+                value = np.asarray(values[variable], dtype=float)
+            except KeyError:
+                raise KeyError(f"no value for variable {variable}") from None
+            if value.ndim > len(shapes[variable]): scenarios = value.shape[:1]
+            arrays[variable] = value
+        x = np.empty((*scenarios, self.size))
+        for variable, index in self.slices.items():
+            x[..., index] = np.broadcast_to(
+                arrays[variable], (*scenarios, *shapes[variable])
+            ).reshape((*scenarios, -1))
+        return x
+
+    def unpack(self, x):
+        """Return a dictionary of values by variable of a state vector (or
+        of a 2d array of state vectors, with a leading axis of scenarios)."""
+        values = {}
+        scenarios = x.shape[:-1]
+        for variable, index in self.slices.items():
+            shape = self.shapes[variable]
+            if shape or scenarios:
+                values[variable] = x[..., index].reshape((*scenarios, *shape))
+            else:
+                values[variable] = float(x[index.start])
+        return values
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {len(self.equations)} equations, "
+                f"{self.size} states>")
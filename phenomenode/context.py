@@ -3,11 +3,67 @@
 """
 from .preferences import preferences
 from typing import Iterable
+from .utils import InternTable, get_owner
+from contextvars import ContextVar
 __all__ = ('ContextStack', 'ContextFamily', 'ContextItem', 'Number',
-           'Inlet', 'Outlet', 'Phase', 'Chemical', 'Contexts')
+           'Inlet', 'Outlet', 'Phase', 'Chemical', 'Contexts', 
+           'get_tickets', 'set_tickets', 'context_key')
 
 Contexts = []
 
+#: [ContextVar] Owner (see `get_owner`) and ticket counters by context tag.
+ticket_state = ContextVar('ticket_state', default=None)
+
+def get_tickets():
+    """
+    Return ticket counters by context tag for the current context. Counters
+    inherited from another thread or task are copied on first use, so they
+    are never shared.
+    
+    """
+    state = ticket_state.get()
+    owner = get_owner()
+    if state is None:
+        state = (owner, {})
+        ticket_state.set(state)
+    elif state[0] != owner:
+        state = (owner, state[1].copy())
+        ticket_state.set(state)
+    return state[1]
+
+def set_tickets(tickets):
+    """Set ticket counters by context tag for the current context."""
+    ticket_state.set((get_owner(), tickets))
+
+def context_key(context):
+    """
+    Return a key of a context which is the same for structurally identical
+    contexts. Value-like context items (inlets, outlets, phases, chemicals, 
+    and numbers) are identified by their class and name, while all other 
+    contexts are unique (families are singletons, stacks are interned, and
+    phenomenodes are objects with their own identity). Stacks hold their 
+    contexts, so identity keys are never reused while a stack is alive.
+    
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> context_key(phn.Phase('gas'))
+    (<class 'phenomenode.context.Phase'>, 'gas')
+    >>> ContextStack(phn.Phase('gas')) is ContextStack(phn.Phase('gas'))
+    True
+    
+    Phenomenodes with the same name are still distinct contexts, so stacks
+    of a rebuilt phenomenode never hold the phenomenode it replaced:
+    
+    >>> ContextStack(phn.Mixer(name=0)) is ContextStack(phn.Mixer(name=0))
+    False
+    
+    """
+    if isinstance(context, value_types):
+        return (context.__class__, context.name)
+    else:
+        return id(context)
+
 def format_name(line):
     words = []
     word = ''
@@ -37,19 +93,45 @@ def format_name(line):
 
 
 class ContextStack:
-    __slots__ = ('stack',)
+    """
+    Create an immutable stack of contexts. Stacks are interned, so 
+    structurally identical stacks (see `context_key`) are the same object 
+    and equality reduces to an identity check.
+    
+    """
+    __slots__ = ('stack', '_hash', '__weakref__')
+    
+    #: [InternTable] Interned context stacks by the keys of their contexts 
+    #: (see `context_key`).
+    interned = InternTable()
     
     def __new__(cls, *stack):
-        self = super().__new__(cls)
-        self.stack = stack
-        return self
+        return cls.from_tuple(stack)
     
     @classmethod
     def from_tuple(cls, tuple):
-        self = super().__new__(cls)
-        self.stack = tuple
+        key = (*map(context_key, tuple),)
+        self = cls.interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            setattr = object.__setattr__
+            setattr(self, 'stack', tuple)
+            setattr(self, '_hash', hash(key))
+            self = cls.interned.setdefault(key, self)
         return self
     
+    def __setattr__(self, name, value):
+        raise AttributeError("context stacks are immutable")
+    
+    def __reduce__(self):
+        return ContextStack.from_tuple, (self.stack,)
+    
+    def __hash__(self):
+        return self._hash
+    
+    def __eq__(self, other):
+        return self is other
+    
     def __bool__(self):
         return bool(self.stack)
     
@@ -153,14 +235,13 @@ class ContextItem:
     __slots__ = ('name',)
     registered_tags = set()
     priority = 0
-    tickets = {}
 
     @property
     def ticket(self):
-        return self.tickets[self.tag]
+        return get_tickets().get(self.tag, 0)
     @ticket.setter
     def ticket(self, ticket):
-        self.tickets[self.tag] = ticket
+        get_tickets()[self.tag] = ticket
         
     def __init_subclass__(cls, tag=None, abstract=False, priority=None):
         if abstract: return
@@ -181,7 +262,6 @@ class ContextItem:
             raise ValueError(f'tag {tag!r} already used')
         cls.tag = tag
         cls.registered_tags.add(tag)
-        cls.tickets[cls.tag] = 0
         cls.family = type(name + 's', (ContextFamily,), {'tag': tag})()
         Contexts.append(cls)
     
@@ -191,8 +271,10 @@ class ContextItem:
         return self
     
     def take_ticket(self):
-        ticket = self.ticket
-        self.ticket += 1
+        tickets = get_tickets()
+        tag = self.tag
+        ticket = tickets.get(tag, 0)
+        tickets[tag] = ticket + 1
         return ticket
     
     __iadd__ = __add__ = ContextFamily.__add__
@@ -228,4 +310,5 @@ class Phase(ContextItem): pass
 class Chemical(ContextItem): pass
 class Number(ContextItem, tag='None'): pass
 
-context_types = (ContextFamily, ContextItem)
\ No newline at end of file
+context_types = (ContextFamily, ContextItem)
+value_types = (Inlet, Outlet, Phase, Chemical, Number)
\ No newline at end of file
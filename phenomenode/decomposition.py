@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from collections import deque
+
+__all__ = (
+    'BlockTriangularForm',
+    'maximum_matching',
+    'strongly_connected_components',
+)
+
+def compressed_rows(rows, columns, shape):
+    # Return index pointer and column indices of a boolean sparse matrix in
+    # compressed sparse row format.
+    n_rows, n_columns = shape
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(n_rows + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, columns[order]
+
+def maximum_matching(indptr, indices, n_columns):
+    """
+    Return the column matched to each row and the row matched to each
+    column (-1 if unmatched) of a maximum matching of a bipartite graph
+    in compressed sparse row format (Hopcroft-Karp algorithm).
+
+    """
+    n_rows = indptr.size - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    row_match = [-1] * n_rows
+    column_match = [-1] * n_columns
+    # Cheap greedy matching speeds up the first phase
+    for row in range(n_rows):
+        for column in indices[indptr[row]:indptr[row + 1]]:
+            if column_match[column] == -1:
+                row_match[row] = column
+                column_match[column] = row
+                break
+    infinity = n_rows + 1
+    while True:
+        # Breadth first search for layers of alternating paths
+        distance = [infinity] * n_rows
+        queue = deque()
+        for row in range(n_rows):
+            if row_match[row] == -1:
+                distance[row] = 0
+                queue.append(row)
+        found = False
+        while queue:
+            row = queue.popleft()
+            next_distance = distance[row] + 1
+            for column in indices[indptr[row]:indptr[row + 1]]:
+                other = column_match[column]
+                if other == -1:
+                    found = True
+                elif distance[other] == infinity:
+                    distance[other] = next_distance
+                    queue.append(other)
+        if not found: break
+        # Depth first search for vertex disjoint augmenting paths
+        pointer = indptr[:-1].copy()
+        for root in range(n_rows):
+            if row_match[root] != -1: continue
+            path = [root]
+            while path:
+                row = path[-1]
+                end = indptr[row + 1]
+                augmented = False
+                while pointer[row] < end:
+                    column = indices[pointer[row]]
+                    pointer[row] += 1
+                    other = column_match[column]
+                    if other == -1:
+                        # Augment along path
+                        for row in reversed(path):
+                            previous = row_match[row]
+                            row_match[row] = column
+                            column_match[column] = row
+                            column = previous
+                        augmented = True
+                        break
+                    elif distance[other] == distance[row] + 1:
+                        path.append(other)
+                        break
+                else:
+                    distance[row] = infinity # Dead end
+                    path.pop()
+                    continue
+                if augmented: break
+    return np.array(row_match, dtype=np.intp), np.array(column_match, dtype=np.intp)
+
+def strongly_connected_components(indptr, indices):
+    """
+    Return the strongly connected components of a directed graph in
+    compressed sparse row format (Tarjan's algorithm). Components are
+    listed in reverse topological order, so that every component comes
+    after all components it has edges to.
+
+    """
+    n = indptr.size - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    index = [-1] * n
+    lowlink = [0] * n
+    on_stack = [False] * n
+    stack = []
+    components = []
+    counter = 0
+    for root in range(n):
+        if index[root] != -1: continue
+        work = [(root, indptr[root])]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, position = work[-1]
+            end = indptr[node + 1]
+            while position < end:
+                other = indices[position]
+                position += 1
+                if index[other] == -1:
+                    work[-1] = (node, position)
+                    index[other] = lowlink[other] = counter
+                    counter += 1
+                    stack.append(other)
+                    on_stack[other] = True
+                    work.append((other, indptr[other]))
+                    break
+                elif on_stack[other] and index[other] < lowlink[node]:
+                    lowlink[node] = index[other]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]: lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        other = stack.pop()
+                        on_stack[other] = False
+                        component.append(other)
+                        if other == node: break
+                    components.append(component)
+    return components
+
+def alternating_reach(starts, indptr, indices, match):
+    # Return boolean masks of the starting side and the other side reached
+    # through alternating paths from unmatched vertices.
+    n_starts = indptr.size - 1
+    reached = np.zeros(n_starts, dtype=bool)
+    reached_others = np.zeros(match.size, dtype=bool)
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    match = match.tolist()
+    queue = deque(starts.tolist())
+    for i in queue: reached[i] = True
+    while queue:
+        i = queue.popleft()
+        for j in indices[indptr[i]:indptr[i + 1]]:
+            if reached_others[j]: continue
+            reached_others[j] = True
+            k = match[j]
+            if k != -1 and not reached[k]:
+                reached[k] = True
+                queue.append(k)
+    return reached, reached_others
+
+
+class BlockTriangularForm:
+    """
+    Create a BlockTriangularForm object which orders the equations (leaf
+    phenomena) and variables of an incidence matrix into a block lower
+    triangular form through the Dulmage-Mendelsohn decomposition.
+
+    A maximum matching of equations to variables divides the system into an
+    overdetermined, a square, and an underdetermined part. The square part
+    is further divided into the strongly connected components of the
+    matched system, ordered so that each block only depends on variables of
+    the overdetermined part and of previous blocks.
+
+    Parameters
+    ----------
+    incidence : IncidenceMatrix
+        Incidence matrix of leaf phenomena by variables.
+    fixed : Iterable[Variable|int], optional
+        Framed variables (or column indices) that are specified and
+        therefore excluded from the decomposition.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> form = phn.StageVLE().block_triangular_form()
+    >>> form.structural_rank
+    18
+    
+    Blocks pair each equation with its matched variable, even if the 
+    overdetermined part has more equations than variables:
+    
+    >>> form = phn.StageVLE().block_triangular_form(fixed=range(0, 30, 2))
+    >>> form.overdetermined_rows.size, form.overdetermined_columns.size
+    (14, 8)
+    >>> all([(form.row_match[i] == j).all() for i, j in form.iter_blocks()])
+    True
+
+    """
+    __slots__ = (
+        'incidence', 'fixed_columns', 'row_match', 'column_match',
+        'overdetermined_rows', 'overdetermined_columns',
+        'underdetermined_rows', 'underdetermined_columns',
+        'row_order', 'column_order', 'block_indptr', 'block_column_indptr',
+    )
+
+    def __init__(self, incidence, fixed=None):
+        n_rows, n_columns = incidence.shape
+        fixed_mask = np.zeros(n_columns, dtype=bool)
+        if fixed is not None:
+            column_index = {j: i for i, j in enumerate(incidence.variables)}
+            for i in fixed:
+                if isinstance(i, (int, np.integer)):
+                    fixed_mask[i] = True
+                elif i in column_index:
+                    fixed_mask[column_index[i]] = True
+        rows = incidence.rows
+        columns = incidence.columns
+        mask = ~fixed_mask[columns]
+        rows = rows[mask]
+        columns = columns[mask]
+        indptr, indices = compressed_rows(rows, columns, incidence.shape)
+        column_indptr, column_indices = compressed_rows(columns, rows, (n_columns, n_rows))
+        row_match, column_match = maximum_matching(indptr, indices, n_columns)
+        free_columns = np.flatnonzero((column_match == -1) & ~fixed_mask)
+        underdetermined_columns, underdetermined_rows = alternating_reach(
+            free_columns, column_indptr, column_indices, row_match
+        )
+        overdetermined_rows, overdetermined_columns = alternating_reach(
+            np.flatnonzero(row_match == -1), indptr, indices, column_match
+        )
+        square_rows = np.flatnonzero(~(overdetermined_rows | underdetermined_rows))
+        # Rows depend on the rows matched to their variables
+        local = np.full(n_rows, -1, dtype=np.intp)
+        local[square_rows] = np.arange(square_rows.size)
+        edges = []
+        for i, row in enumerate(square_rows.tolist()):
+            for column in indices[indptr[row]:indptr[row + 1]].tolist():
+                other = local[column_match[column]] if column_match[column] != -1 else -1
+                if other != -1 and other != i: edges.append((i, other))
+        if edges:
+            edge_rows, edge_columns = np.array(edges, dtype=np.intp).T
+        else:
+            edge_rows = edge_columns = np.zeros(0, dtype=np.intp)
+        graph_indptr, graph_indices = compressed_rows(
+            edge_rows, edge_columns, (square_rows.size, square_rows.size)
+        )
+        blocks = strongly_connected_components(graph_indptr, graph_indices)
+        block_rows = [square_rows[i] for i in blocks]
+        first_rows = np.flatnonzero(overdetermined_rows)
+        last_rows = np.flatnonzero(underdetermined_rows)
+        row_order = np.concatenate([first_rows, *block_rows, last_rows]).astype(np.intp)
+        column_order = np.concatenate([
+            np.flatnonzero(overdetermined_columns),
+            *[row_match[i] for i in block_rows],
+            np.flatnonzero(underdetermined_columns),
+        ]).astype(np.intp)
+        block_sizes = np.zeros(len(blocks) + 1, dtype=np.intp)
+        np.cumsum([len(i) for i in blocks], out=block_sizes[1:])
+        # Rows and columns of blocks are offset by the overdetermined part,
+        # which may have fewer columns than rows
+        first_columns = np.flatnonzero(overdetermined_columns)
+        block_indptr = block_sizes + first_rows.size
+        block_column_indptr = block_sizes + first_columns.size
+        setfield = object.__setattr__
+        setfield(self, 'incidence', incidence)
+        setfield(self, 'fixed_columns', np.flatnonzero(fixed_mask))
+        setfield(self, 'row_match', row_match)
+        setfield(self, 'column_match', column_match)
+        setfield(self, 'overdetermined_rows', first_rows)
+        setfield(self, 'overdetermined_columns', first_columns)
+        setfield(self, 'underdetermined_rows', last_rows)
+        setfield(self, 'underdetermined_columns', np.flatnonzero(underdetermined_columns))
+        setfield(self, 'row_order', row_order)
+        setfield(self, 'column_order', column_order)
+        setfield(self, 'block_indptr', block_indptr)
+        setfield(self, 'block_column_indptr', block_column_indptr)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("block triangular forms are read-only")
+
+    @property
+    def structural_rank(self):
+        """[int] Number of matched equations."""
+        return int((self.row_match != -1).sum())
+
+    @property
+    def n_blocks(self):
+        """[int] Number of blocks in the square part."""
+        return self.block_indptr.size - 1
+
+    @property
+    def block_sizes(self):
+        """[1d array[int]] Number of equations in each block."""
+        return np.diff(self.block_indptr)
+
+    def block(self, index):
+        """Return the row and column indices of a block."""
+        start, end = self.block_indptr[index:index + 2]
+        rows = self.row_order[start:end]
+        start, end = self.block_column_indptr[index:index + 2]
+        return rows, self.column_order[start:end]
+
+    def iter_blocks(self):
+        """Iterate over the row and column indices of all blocks in order."""
+        for i in range(self.n_blocks): yield self.block(i)
+
+    def block_phenomena(self, index):
+        """Return the phenomena and framed variables of a block."""
+        rows, columns = self.block(index)
+        incidence = self.incidence
+        return (
+            [incidence.phenomena[i] for i in rows],
+            [incidence.variables[i] for i in columns]
+        )
+
+    def __repr__(self):
+        sizes = self.block_sizes
+        return (f"<{type(self).__name__}: {self.n_blocks} blocks, largest "
+                f"{sizes.max() if sizes.size else 0}, "
+                f"{self.overdetermined_rows.size} overdetermined and "
+                f"{self.underdetermined_rows.size} underdetermined equations>")
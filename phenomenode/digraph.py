@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 """
 """
+import re
+import io
+import os
+import shutil
+import hashlib
+import subprocess
+import tempfile
 import phenomenode as phn
 from .connection import Connection
 from warnings import warn
-from graphviz import Digraph
+from graphviz import Digraph, ExecutableNotFound, CalledProcessError
 from IPython import display
 
-__all__ = ('digraph_from_phenomenode',
+__all__ = ('DotWriter',
+           'RenderCache',
+           'digraph_from_phenomenode',
+           'stream_digraph',
            'blank_digraph',
            'finalize_digraph',
            'display_digraph',
@@ -15,11 +25,309 @@ __all__ = ('digraph_from_phenomenode',
 
 preferences = phn.preferences
 
+ID = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))$')
+
+HTML = re.compile(r'<.*>$', re.DOTALL)
+
+KEYWORDS = frozenset(['node', 'edge', 'graph', 'digraph', 'subgraph', 'strict'])
+
+def quote(value):
+    # Return DOT identifier of a value, quoted if needed
+    value = str(value)
+    if HTML.match(value): return value # HTML-like labels (e.g., subscripts)
+    if ID.match(value) and value.lower() not in KEYWORDS: return value
+    return '"' + value.replace('\\"', '"').replace('"', '\\"') + '"'
+
+def attributes(attrs):
+    # Return DOT attribute list
+    return ' '.join([f"{i}={quote(j)}" for i, j in attrs.items()])
+
+
+class DotWriter:
+    """
+    Create a DotWriter object which writes the DOT source code of a
+    directed graph straight into a buffer (or a text file). Nodes and edges
+    are written in groups (anonymous subgraphs) with shared default
+    attributes, so that attributes common to a group are only written once.
+    
+    Parameters
+    ----------
+    format : str, optional
+        Image format of rendered graph. Defaults to 'svg'.
+    file : TextIO, optional
+        Text file to write to. Defaults to an in-memory buffer.
+    **graph_attrs : str
+        Graph attributes.
+    
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> f = phn.DotWriter(rankdir='LR')
+    >>> f.nodes([{'name': 'a', 'shape': 'point'}, {'name': 'b', 'shape': 'point'}])
+    >>> f.edges({'color': '#90918e'}, [('a', 'b', None)])
+    >>> f.nodes([{'name': 'c', 'label': '<H<SUB>0</SUB>>'}])
+    >>> print(f.source) # doctest: +NORMALIZE_WHITESPACE
+    digraph {
+    	graph [rankdir=LR]
+    	{
+    		node [shape=point]
+    		a
+    		b
+    	}
+    	{
+    		edge [color="#90918e"]
+    		a -> b
+    	}
+    	{
+    		node [label=<H<SUB>0</SUB>>]
+    		c
+    	}
+    }
+    <BLANKLINE>
+    >>> digraph = f.to_graphviz()
+    >>> digraph.edge('b', 'c')
+    >>> digraph.source.splitlines()[-2:] == ['\\tb -> c', '}']
+    True
+    
+    """
+    __slots__ = ('format', 'buffer')
+    
+    def __init__(self, format='svg', file=None, **graph_attrs):
+        self.format = format
+        self.buffer = io.StringIO() if file is None else file
+        self.buffer.write("digraph {\n")
+        if graph_attrs: self.attr('graph', **graph_attrs)
+    
+    def attr(self, kind, **attrs):
+        """Write default attributes of 'graph', 'node', or 'edge' statements."""
+        self.buffer.write(f"\t{kind} [{attributes(attrs)}]\n")
+    
+    def nodes(self, options):
+        """Write nodes given their attributes (including 'name') in a
+        group with attributes shared by all nodes as defaults."""
+        options = list(options)
+        if not options: return
+        shared = {
+            i: j for i, j in options[0].items() 
+            if i != 'name' and all([i in k and k[i] == j for k in options])
+        }
+        write = self.buffer.write
+        write("\t{\n")
+        if shared: write(f"\t\tnode [{attributes(shared)}]\n")
+        for i in options:
+            name = quote(i['name'])
+            other = {j: k for j, k in i.items() if j != 'name' and j not in shared}
+            write(f"\t\t{name} [{attributes(other)}]\n" if other else f"\t\t{name}\n")
+        write("\t}\n")
+    
+    def edges(self, attrs, edges):
+        """Write edges given their tail, head, and attributes (a dictionary,
+        a preformatted attribute list, or None) in a group with the given
+        default attributes."""
+        write = self.buffer.write
+        write("\t{\n")
+        if attrs: write(f"\t\tedge [{attributes(attrs)}]\n")
+        for tail, head, other in edges:
+            if other:
+                if not isinstance(other, str): other = attributes(other)
+                write(f"\t\t{quote(tail)} -> {quote(head)} [{other}]\n")
+            else:
+                write(f"\t\t{quote(tail)} -> {quote(head)}\n")
+        write("\t}\n")
+    
+    def close(self):
+        """Write the end of the graph."""
+        self.buffer.write("}\n")
+    
+    @property
+    def source(self):
+        """[str] DOT source code (of graphs written in memory)."""
+        return self.buffer.getvalue() + "}\n"
+    
+    def to_graphviz(self):
+        """Return a graphviz.Digraph object of the graph, which may be 
+        rendered or extended with more nodes, edges, and attributes."""
+        return Digraph(format=self.format, body=self.source.splitlines(True)[1:-1])
+    
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.buffer.tell()} characters>"
+
+
+class TooltipCache:
+    """
+    Create a TooltipCache object which memoizes tooltip and label strings
+    of nodes by node and format during a single rendering, so that nodes
+    and edges of the same phenomenon share a single description.
+    
+    """
+    __slots__ = ('strings',)
+    
+    def __init__(self):
+        self.strings = {}
+    
+    def __call__(self, node, fmt=None):
+        """Return the tooltip string of a node (in the given format for
+        variable nodes)."""
+        key = (node, fmt)
+        strings = self.strings
+        if key in strings: return strings[key]
+        string = strings[key] = node.get_tooltip_string() if fmt is None else node.get_tooltip_string(fmt)
+        return string
+
+
+class RenderCache:
+    """
+    Create a RenderCache object which keeps rendered diagrams on disk,
+    keyed by a hash of their DOT source, format, layout engine, and dpi.
+    Cached images are reused instead of running Graphviz again, and least
+    recently used images are removed once the cache exceeds its maximum
+    size. Images are rendered into temporary files and atomically moved
+    into place, so several processes may share the same cache. Diagrams 
+    are only cached if `preferences.render_cache` is True (off by default).
+    
+    Parameters
+    ----------
+    path : str, optional
+        Directory of cached images. Defaults to 'phenomenode/diagrams'
+        in the user cache directory.
+    maxsize : int, optional
+        Maximum total size of cached images in bytes. Defaults to 256 MB.
+    
+    """
+    __slots__ = ('path', 'maxsize')
+    
+    def __init__(self, path=None, maxsize=256 * 2**20):
+        if path is None:
+            home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            path = os.path.join(home, 'phenomenode', 'diagrams')
+        self.path = path
+        self.maxsize = maxsize
+    
+    def key(self, chunks, format, engine='dot', dpi=None):
+        """Return the hash of DOT source (given as chunks of bytes) and
+        rendering options."""
+        key = hashlib.sha256(f"{format}\0{engine}\0{dpi}\0".encode())
+        for i in chunks: key.update(i)
+        return key.hexdigest()
+    
+    def render(self, source, format, engine='dot', dpi=None):
+        """Return the path of the rendered image of DOT source code, which
+        is only rendered if not cached."""
+        source = source.encode('utf-8')
+        key = self.key([source], format, engine, dpi)
+        return self._render(key, format, engine, dpi, source, None)
+    
+    def render_file(self, file, format, engine='dot', dpi=None):
+        """Return the path of the rendered image of a DOT file, which is
+        only rendered if not cached."""
+        with open(file, 'rb') as stream:
+            key = self.key(iter(lambda: stream.read(2**20), b''), format, engine, dpi)
+        return self._render(key, format, engine, dpi, None, file)
+    
+    def _render(self, key, format, engine, dpi, source, file):
+        image = os.path.join(self.path, f"{key}.{format}")
+        try:
+            os.utime(image) # Mark as recently used
+        except FileNotFoundError:
+            pass
+        else:
+            return image
+        os.makedirs(self.path, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        os.close(descriptor)
+        command = [engine, f'-T{format}', '-o', temporary]
+        if dpi is not None: command.append(f'-Gdpi={dpi}')
+        if file is not None: command.append(file)
+        try:
+            run_graphviz(command, source)
+            os.replace(temporary, image)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict(image)
+        return image
+    
+    def pipe(self, source, format, engine='dot', dpi=None):
+        """Return the rendered image of DOT source code as bytes."""
+        return self._read(self.render, source, format, engine, dpi)
+    
+    def pipe_file(self, file, format, engine='dot', dpi=None):
+        """Return the rendered image of a DOT file as bytes."""
+        return self._read(self.render_file, file, format, engine, dpi)
+    
+    def _read(self, render, *args):
+        # Other processes may evict the image between rendering and opening
+        # it, in which case it is rendered again. Once open, it can be read
+        # even if removed.
+        try:
+            stream = open(render(*args), 'rb')
+        except FileNotFoundError:
+            stream = open(render(*args), 'rb')
+        with stream: return stream.read()
+    
+    def evict(self, keep=None):
+        """Remove least recently used images until the cache fits in its
+        maximum size (except the image to keep)."""
+        entries = []
+        with os.scandir(self.path) as scan:
+            for i in scan:
+                if i.name.endswith('.tmp') or i.path == keep: continue
+                try:
+                    stat = i.stat()
+                except FileNotFoundError: # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, i.path))
+        size = sum([i[1] for i in entries])
+        if keep is not None: size += os.path.getsize(keep)
+        if size <= self.maxsize: return
+        entries.sort()
+        for time, filesize, path in entries:
+            try:
+                os.remove(path)
+            except OSError: # Removed or still open in another process
+                continue
+            size -= filesize
+            if size <= self.maxsize: break
+    
+    def clear(self):
+        """Remove all cached images."""
+        if os.path.isdir(self.path): shutil.rmtree(self.path, ignore_errors=True)
+    
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.path}>"
+
+
+def run_graphviz(command, source=None):
+    # Run a Graphviz executable and raise the same exceptions as graphviz 
+    # objects if it is missing or fails (including its error messages).
+    try:
+        subprocess.run(
+            command, input=source, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise ExecutableNotFound(command) from None
+    except subprocess.CalledProcessError as error:
+        raise CalledProcessError(
+            error.returncode, error.cmd, error.output, error.stderr
+        ) from None
+
+#: [RenderCache] Cache of rendered diagrams (see `preferences.render_cache`).
+render_cache = RenderCache()
+
+def pipe_digraph(digraph, format):
+    # Return the rendered image of a graphviz object as bytes
+    if preferences.render_cache:
+        return render_cache.pipe(digraph.source, format, digraph.engine)
+    else:
+        return digraph.pipe(format=format)
+
 def blank_digraph(format='svg', maxiter='10000', 
-                  Damping='0.2', K='0.2', **graph_attrs):
+                  Damping='0.2', K='0.2', file=None, **graph_attrs):
     # Create a digraph and set direction left to right
-    f = Digraph(format=format)
-    f.attr(rankdir='LR', 
+    f = DotWriter(format=format, file=file)
+    f.attr('graph',
+           rankdir='LR', 
            maxiter=maxiter, 
            Damping=Damping, 
            K=K,
@@ -47,13 +355,99 @@ def stream_varnodes(phenomenode, varnodes=None):
     return varnodes
 
 def digraph_from_phenomenode(phenomenode, filterkey, **graph_attrs):
+    """
+    Return a graphviz Digraph object of the phenomena and variable nodes
+    of a phenomenode.
+    
+    Examples
+    --------
+    HTML-like labels are written unquoted, so that Graphviz renders their
+    subscripts:
+    
+    >>> import phenomenode as phn
+    >>> with phn.preferences.temporary() as preferences:
+    ...     preferences.label_format = 'h'
+    ...     preferences.label_nodes = True
+    ...     digraph = digraph_from_phenomenode(phn.Mixer(), None)
+    >>> lines = [i for i in digraph.source.splitlines() if 'label=<' in i]
+    >>> for i in sorted(set([i.split('label=')[1][:-1] for i in lines])): print(i)
+    <F<SUB>c, p, o=0</SUB>>
+    <H<SUB>0</SUB>>
+    <H<SUB>1</SUB>>
+    <H<SUB>2</SUB>>
+    <P<SUB>o=0</SUB>>
+    <ΔT<SUB>o=0</SUB>>
+    <δH/δT<SUB>o=0</SUB>>
+    
+    """
     f = blank_digraph(**graph_attrs)
     bridge_nodes = set(stream_varnodes(phenomenode))
     nodes = get_all_nodes(phenomenode)
     update_digraph_from_phenomena(
         f, nodes, filterkey, bridge_nodes
     )
-    return f
+    return f.to_graphviz()
+
+def stream_digraph(phenomenode, file, format=None, filterkey=None, engine='fdp', **graph_attrs):
+    """
+    Save a diagram of a phenomenode to a file without holding the DOT
+    source or the rendered image in memory. The DOT source is written to
+    a temporary file while traversing leaf phenomena, and the Graphviz
+    executable (`engine`) renders it straight into the target file.
+    
+    """
+    if '.' not in file:
+        if format is None: format = preferences.graphviz_format
+        file += '.' + format
+    elif format is None:
+        format = file.rsplit('.', 1)[-1]
+    else:
+        raise ValueError(
+            "cannot specify format extension; file already has format "
+           f"extension '{file.rsplit('.', 1)[-1]}'"
+        )
+    if format == 'tex': # dot2tex requires the whole source
+        import dot2tex
+        source = digraph_from_phenomenode(phenomenode, filterkey, format=format, **graph_attrs).source
+        with open(file, 'w', encoding="utf-8") as buffer:
+            buffer.write(dot2tex.dot2tex(source, math=True))
+        return
+    if format in ('dot', 'gv'):
+        with open(file, 'w', encoding="utf-8") as buffer:
+            write_digraph(buffer, phenomenode, filterkey, format=format, **graph_attrs)
+        return
+    descriptor, source = tempfile.mkstemp(suffix='.gv')
+    try:
+        with open(descriptor, 'w', encoding="utf-8") as buffer:
+            write_digraph(buffer, phenomenode, filterkey, format=format, **graph_attrs)
+        if preferences.raise_exception:
+            render_file(source, file, format, engine)
+        else:
+            try:
+                render_file(source, file, format, engine)
+            except (OSError, TypeError) as exp:
+                raise exp from None
+            except Exception as exp:
+                warn_graphviz_error(exp)
+    finally:
+        os.remove(source)
+
+def render_file(source, file, format, engine):
+    # Render a DOT file into an image file
+    if preferences.render_cache:
+        with open(file, 'wb') as stream:
+            stream.write(render_cache.pipe_file(source, format, engine))
+    else:
+        run_graphviz([engine, f'-T{format}', source, '-o', file])
+
+def write_digraph(buffer, phenomenode, filterkey, **graph_attrs):
+    f = blank_digraph(file=buffer, **graph_attrs)
+    bridge_nodes = set(stream_varnodes(phenomenode))
+    nodes = get_all_nodes(phenomenode)
+    update_digraph_from_phenomena(
+        f, nodes, filterkey, bridge_nodes
+    )
+    f.close()
 
 def get_all_nodes(phenomenode, nodes=None):
     if nodes is None: nodes = []
@@ -64,24 +458,36 @@ def get_all_nodes(phenomenode, nodes=None):
         nodes.append(phenomenode)
     return nodes
 
-def update_digraph_from_phenomena(f, nodes, filterkey, bridge_nodes):
+def update_digraph_from_phenomena(f, nodes, filterkey, bridge_nodes, chunksize=100):
+    # Connections are written in chunks of leaf phenomena, so that only
+    # node names are kept in memory
+    add_defaults(f)
+    tooltips = TooltipCache()
     all_connections = set()
-    for i in nodes:
-        if not (filterkey and filterkey(i)): 
-            varnodes = i.outlet_varnodes if preferences.outputs_only else i.varnodes
-            for varnode in varnodes:
-                connection = Connection(i, varnode)
-                all_connections.add(connection)
-                for neighbor in varnode.neighbors:
-                    if neighbor.phenomena: continue
-                    if filterkey and filterkey(neighbor): continue
-                    connection = Connection(neighbor, varnode)
-                    all_connections.add(connection)
-    varnodes = set([i.varnode for i in all_connections])
-    nodes = set([i.phenomenode for i in all_connections])
-    varnode_names = get_varnode_names(f, varnodes, bridge_nodes)
-    phenomenode_names = get_phenomenode_names(f, nodes)
-    add_connections(f, all_connections, phenomenode_names, varnode_names)
+    varnode_names = {}
+    phenomenode_names = {}
+    for start in range(0, len(nodes), chunksize):
+        connections = []
+        for i in nodes[start:start + chunksize]:
+            if not (filterkey and filterkey(i)): 
+                varnodes = i.outlet_varnodes if preferences.outputs_only else i.varnodes
+                for varnode in varnodes:
+                    connection = Connection(i, varnode)
+                    if connection not in all_connections:
+                        all_connections.add(connection)
+                        connections.append(connection)
+                    for neighbor in varnode.neighbors:
+                        if neighbor.has_phenomena: continue
+                        if filterkey and filterkey(neighbor): continue
+                        connection = Connection(neighbor, varnode)
+                        if connection not in all_connections:
+                            all_connections.add(connection)
+                            connections.append(connection)
+        varnodes = {i.varnode: None for i in connections if i.varnode not in varnode_names}
+        phenomena = {i.phenomenode: None for i in connections if i.phenomenode not in phenomenode_names}
+        varnode_names.update(get_varnode_names(f, varnodes, bridge_nodes, tooltips))
+        phenomenode_names.update(get_phenomenode_names(f, phenomena, tooltips))
+        add_connections(f, connections, phenomenode_names, varnode_names, tooltips)
     
 
 # def update_digraph_from_path(f, path, depth, node_names, all_connections,
@@ -158,47 +564,33 @@ def update_digraph_from_phenomena(f, nodes, filterkey, bridge_nodes):
 #                                      bridge_nodes, depths)
 
 
-def get_phenomenode_names(f: Digraph, path):
+def get_phenomenode_names(f: DotWriter, path, tooltips):
     node_names = {}
+    groups = {} # Node options by color
     for n in path:
-        kwargs = n.vizoptions()
+        kwargs = n.vizoptions(tooltips(n))
         node_names[n] = kwargs['name']
-        f.node(**kwargs)
+        color = kwargs.get('color')
+        if color in groups:
+            groups[color].append(kwargs)
+        else:
+            groups[color] = [kwargs]
+    for i in groups.values(): f.nodes(i)
     return node_names
 
-def get_varnode_names(f: Digraph, varnodes, bridge_nodes):
+def get_varnode_names(f: DotWriter, varnodes, bridge_nodes, tooltips):
     node_names = {}
+    options = []
+    label_format = preferences.label_format
     for n in varnodes:
-        kwargs = n.vizoptions()
+        kwargs = n.vizoptions(tooltips(n, label_format))
         node_names[n] = kwargs['name']
         # if n in bridge_nodes and n.variable.highlight and n.sources and preferences.highlight: kwargs['color'] = '#f3c354'
-        f.node(**kwargs)
+        options.append(kwargs)
+    f.nodes(options)
     return node_names
 
-def add_connection(f: Digraph, connection, phenomenode_names, varnode_names, **edge_options):
-    phenomenode = connection.phenomenode
-    varnode = connection.varnode
-    f.attr('edge', label='', taillabel='', headlabel='', labeldistance='1',
-           **edge_options)
-    options = {}
-    if preferences.tooltip:
-        options['labeltooltip'] = options['edgetooltip'] = phenomenode.get_tooltip_string()
-    graphics = phenomenode.graphics
-    color = (graphics.subcolor or graphics.color) if preferences.subcategory else graphics.color
-    penwidth = '3'
-    directed = (preferences.directed and graphics.directed and varnode in phenomenode.outs)
-    f.edge(phenomenode_names[phenomenode], varnode_names[varnode], label='', 
-           arrowtail='none', 
-           arrowhead='normal' if directed else 'none', headport='c', 
-           tailport='c', 
-           color=color,
-           len='0.5',
-           dir='forward' if directed else 'none',
-           penwidth=penwidth,
-           style='dashed' if graphics.category == 'hidden' else 'solid',
-           **options)
-
-def add_connections(f: Digraph, connections, phenomenode_names, varnode_names, **edge_options):
+def add_defaults(f: DotWriter, **edge_options):
     # Set attributes for graph and edges
     f.attr('graph', 
            splines='curved', 
@@ -210,19 +602,65 @@ def add_connections(f: Digraph, connections, phenomenode_names, varnode_names, *
            dir='none')
     f.attr('edge', 
            concentrate='true',
-           dir='none')
-    for connection in connections:
-        add_connection(f, connection, phenomenode_names, varnode_names,
-                       **edge_options)
+           dir='none',
+           label='', 
+           taillabel='', 
+           headlabel='', 
+           labeldistance='1',
+           arrowtail='none', 
+           headport='c', 
+           tailport='c', 
+           len='0.5',
+           penwidth='3',
+           **edge_options)
+
+def add_connections(f: DotWriter, connections, phenomenode_names, varnode_names, tooltips):
+    # Group edges by style
+    tooltip = preferences.tooltip
+    subcategory = preferences.subcategory
+    directed = preferences.directed
+    groups = {}
+    edge_tooltips = {} # Preformatted tooltip attributes by phenomenon
+    for phenomenode, varnode in connections:
+        graphics = phenomenode.graphics
+        color = (graphics.subcolor or graphics.color) if subcategory else graphics.color
+        style = (
+            color, 
+            directed and graphics.directed and varnode in phenomenode.outs,
+            graphics.category == 'hidden',
+        )
+        if tooltip:
+            if phenomenode in edge_tooltips:
+                options = edge_tooltips[phenomenode]
+            else:
+                tooltip_string = quote(tooltips(phenomenode))
+                options = edge_tooltips[phenomenode] = (
+                    f"labeltooltip={tooltip_string} edgetooltip={tooltip_string}"
+                )
+        else:
+            options = None
+        edge = (phenomenode_names[phenomenode], varnode_names[varnode], options)
+        if style in groups:
+            groups[style].append(edge)
+        else:
+            groups[style] = [edge]
+    for (color, directed, hidden), edges in groups.items():
+        f.edges(
+            {'arrowhead': 'normal' if directed else 'none',
+             'color': color,
+             'dir': 'forward' if directed else 'none',
+             'style': 'dashed' if hidden else 'solid'},
+            edges
+        )
 
 def display_digraph(digraph, format): # pragma: no coverage
     if format is None: format = preferences.graphviz_format
     if format == 'svg':
-        img = digraph.pipe(format=format)
+        img = pipe_digraph(digraph, format)
         x = display.SVG(img)
         display.display(x)
     else:
-        x = display.Image(digraph.pipe(format='png'))
+        x = display.Image(pipe_digraph(digraph, 'png'))
         display.display(x)
 
 def save_digraph(digraph, file, format): # pragma: no coverage
@@ -243,7 +681,7 @@ def save_digraph(digraph, file, format): # pragma: no coverage
         f.write(texcode)
         f.close()
     else:
-        img = digraph.pipe(format=format)
+        img = pipe_digraph(digraph, format)
         f = open(file, 'wb')
         f.write(img)
         f.close()
@@ -259,9 +697,12 @@ def finalize_digraph(digraph, file, format): # pragma: no coverage
         except (OSError, TypeError) as exp:
             raise exp from None
         except Exception as exp: 
-            warn(
-                f"a '{type(exp).__name__}' was raised when generating "
-                "graphviz diagram, possibly due to graphviz installation issues, "
-                "make sure Graphviz executables are on your systems' PATH",
-                RuntimeWarning
-            )
+            warn_graphviz_error(exp)
+
+def warn_graphviz_error(exp): # pragma: no coverage
+    warn(
+        f"a '{type(exp).__name__}' was raised when generating "
+        "graphviz diagram, possibly due to graphviz installation issues, "
+        "make sure Graphviz executables are on your systems' PATH",
+        RuntimeWarning
+    )
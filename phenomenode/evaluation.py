@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+from .variable import Variable, FunctionCall, index as I
+from .context import ContextStack
+from .quantity import Quantities
+from .term import Term
+
+__all__ = ('get_variables', 'is_reduction')
+
+def is_reduction(function, family=I.chemicals):
+    """
+    Return whether the function reduces a family of contexts
+    (e.g., a sum over chemicals).
+    
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> from phenomenode.variable import index as I
+    >>> phn.is_reduction(phn.Variable('Σ', I.chemicals)), phn.is_reduction(phn.Variable('Σ'))
+    (True, False)
+    
+    """
+    context = function.context
+    if isinstance(context, ContextStack):
+        return family in context.stack
+    else:
+        return context is family
+
+def flatten(parameters):
+    flat = []
+    for i in parameters:
+        if isinstance(i, (list, tuple)):
+            flat.extend(flatten(i))
+        else:
+            flat.append(i)
+    return flat
+
+def get_variables(quantity):
+    """
+    Return all variables of a quantity (with repeats) in order of appearance.
+    
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> P, T = phn.Variable('P'), phn.Variable('T')
+    >>> phn.get_variables(P * T + P)
+    [Variable('P', ContextStack()), Variable('T', ContextStack()), Variable('P', ContextStack())]
+    
+    """
+    if isinstance(quantity, Variable):
+        return [quantity]
+    elif isinstance(quantity, Term):
+        return get_variables(quantity.left) + get_variables(quantity.right)
+    elif isinstance(quantity, FunctionCall):
+        return [j for i in flatten(quantity.parameters) for j in get_variables(i)]
+    elif isinstance(quantity, Quantities):
+        return [j for i in quantity.quantities for j in get_variables(i)]
+    elif isinstance(quantity, (list, tuple)):
+        return [j for i in quantity for j in get_variables(i)]
+    else:
+        return []
@@ -61,11 +61,11 @@ class Gate:
         variables = []
         for i in self.nodes:
             if hasattr(i, 'varnodes'):
-                variables.append([i.variable.framed(i.get_full_context()) for i in i.varnodes])
+                variables.append([i.get_framed_variable() for i in i.varnodes])
             elif hasattr(i, '__iter__'):
-                variables.append([i.variable.framed(i.get_full_context()) for i in i])
+                variables.append([i.get_framed_variable() for i in i])
             else:
-                variables.append(i.variable.framed(i.get_full_context()))
+                variables.append(i.get_framed_variable())
         return variables
     
     def _create_node(self, variable):
@@ -194,6 +194,7 @@ class Inlets(Gate):
             for i in node: self._dock(i)
         elif not (node.sinks and node.sinks[-1] is self.sink):
             node.sinks.appendleft(self.sink)
+            node.graph_changed()
         return node
 
     def _undock(self, node): 
@@ -220,6 +221,7 @@ class Outlets(Gate):
             for i in node: self._dock(i)
         elif not (node.sources and node.sources[-1] is self.source):
             node.sources.appendleft(self.source)
+            node.graph_changed()
         return node
     
     def _undock(self, node): 
@@ -67,7 +67,7 @@ class PhenomeNodeGraphics:
     def get_options(self, node): # pragma: no coverage
         """Return node tailored to node specifications"""
         options = self.options.copy()
-        options['name'] = str(hash(node))
+        options['name'] = node.tag_path
         options['label'] = ''
         color = (self.subcolor or self.color) if phn.preferences.subcategory else self.color
         options['fillcolor'] = options['fontcolor'] = options['color'] = color
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from .context import ContextStack
+from .compact import frozen
+try:
+    from scipy import sparse
+except ImportError: # pragma: no cover
+    sparse = None
+
+__all__ = ('IncidenceMatrix',)
+
+
+class IncidenceMatrix:
+    """
+    Create a read-only IncidenceMatrix object of leaf phenomena (rows) by
+    unique framed variables (columns). Variable nodes that frame the same
+    variable share a column. Entries are stored in coordinate (COO) format
+    and flag whether the variable is an inlet (1) and/or an outlet (2) of
+    the phenomenon.
+
+    Parameters
+    ----------
+    phenomenode : PhenomeNode
+        Phenomenode with leaf phenomena.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> incidence = phn.StageVLE().incidence_matrix()
+    >>> incidence.shape
+    (18, 30)
+
+    Each row flags the framed variables of the inlets and outlets of its 
+    leaf phenomenon:
+
+    >>> incidence = phn.MultiStageVLE(n_stages=3).incidence_matrix()
+    >>> column = {j: i for i, j in enumerate(incidence.variables)}
+    >>> def dense_row(phenomenon):
+    ...     row = [0] * incidence.shape[1]
+    ...     for i in phenomenon.ins.varnodes: 
+    ...         row[column[i.get_framed_variable()]] |= incidence.INLET
+    ...     for i in phenomenon.outs.varnodes: 
+    ...         row[column[i.get_framed_variable()]] |= incidence.OUTLET
+    ...     return row
+    >>> array = incidence.toarray()
+    >>> all([array[i].tolist() == dense_row(j) for i, j in enumerate(incidence.phenomena)])
+    True
+
+    """
+    __slots__ = (
+        'phenomenode', 'rows', 'columns', 'data', 'shape',
+        'phenomena', 'categories', 'subcategories', 'linear', 'directed',
+        'row_contexts', 'variables', 'varnodes', 'column_contexts',
+    )
+
+    #: [int] Entry flag of inlet variables.
+    INLET = 1
+
+    #: [int] Entry flag of outlet variables.
+    OUTLET = 2
+
+    def __init__(self, phenomenode):
+        if phenomenode.phenomena:
+            graph = phenomenode.compact_graph()
+            leaves = np.flatnonzero(graph.leaves)
+            phenomena = tuple([graph.phenomena[i] for i in leaves])
+            all_varnodes = graph.varnodes
+            row_index = np.full(graph.n_phenomena, -1, dtype=np.intp)
+            row_index[leaves] = np.arange(leaves.size)
+            incidences = []
+            for role, indptr, indices in (
+                    (self.INLET, graph.sink_indptr, graph.sink_indices),
+                    (self.OUTLET, graph.source_indptr, graph.source_indices)
+                ):
+                rows = row_index[np.repeat(np.arange(graph.n_phenomena), np.diff(indptr))]
+                mask = rows != -1
+                incidences.append((role, rows[mask], indices[mask]))
+        else: # Single phenomenon
+            phenomena = (phenomenode,)
+            varnode_index = {}
+            incidences = []
+            for role, gate_varnodes in (
+                    (self.INLET, phenomenode.inlet_varnodes),
+                    (self.OUTLET, phenomenode.outlet_varnodes)
+                ):
+                indices = np.array(
+                    [varnode_index.setdefault(i, len(varnode_index)) for i in gate_varnodes], 
+                    dtype=np.intp
+                )
+                incidences.append((role, np.zeros(indices.size, dtype=np.intp), indices))
+            all_varnodes = tuple(varnode_index)
+        n_phenomena = len(phenomena)
+        column_index = {}
+        varnode_columns = np.full(len(all_varnodes), -1, dtype=np.intp)
+        variables = []
+        varnodes = []
+        row_parts = []
+        column_parts = []
+        data_parts = []
+        for role, rows, indices in incidences:
+            for i in indices.tolist():
+                if varnode_columns[i] != -1: continue
+                varnode = all_varnodes[i]
+                variable = varnode.get_framed_variable()
+                if variable in column_index:
+                    column = column_index[variable]
+                    varnodes[column].append(varnode)
+                else:
+                    column = column_index[variable] = len(variables)
+                    variables.append(variable)
+                    varnodes.append([varnode])
+                varnode_columns[i] = column
+            row_parts.append(rows)
+            column_parts.append(varnode_columns[indices])
+            data_parts.append(np.full(rows.size, role, dtype=np.int8))
+        n_variables = len(variables)
+        rows = np.concatenate(row_parts)
+        columns = np.concatenate(column_parts)
+        data = np.concatenate(data_parts)
+        keys = rows * n_variables + columns
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        data = data[order]
+        if keys.size:
+            starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+            data = np.bitwise_or.reduceat(data, starts)
+            keys = keys[starts]
+        rows, columns = np.divmod(keys, max(n_variables, 1))
+        setfield = object.__setattr__
+        setfield(self, 'phenomenode', phenomenode)
+        setfield(self, 'rows', frozen(rows))
+        setfield(self, 'columns', frozen(columns))
+        setfield(self, 'data', frozen(data))
+        setfield(self, 'shape', (n_phenomena, n_variables))
+        setfield(self, 'phenomena', phenomena)
+        setfield(self, 'categories', tuple([i.category for i in phenomena]))
+        setfield(self, 'subcategories', tuple([i.subcategory for i in phenomena]))
+        setfield(self, 'linear', tuple([i.linear for i in phenomena]))
+        setfield(self, 'directed', tuple([i.directed for i in phenomena]))
+        setfield(self, 'row_contexts', tuple([
+            ContextStack.from_tuple(tuple(i.ancestry[1:-1])) for i in phenomena
+        ]))
+        setfield(self, 'variables', tuple(variables))
+        setfield(self, 'varnodes', tuple([tuple(i) for i in varnodes]))
+        setfield(self, 'column_contexts', tuple([i[0].get_full_context() for i in varnodes]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("incidence matrices are read-only")
+
+    @property
+    def nnz(self):
+        """[int] Number of nonzero entries."""
+        return self.data.size
+
+    @property
+    def matrix(self):
+        """[scipy.sparse.csr_array] Incidence matrix in compressed sparse
+        row format."""
+        if sparse is None: raise RuntimeError('scipy is required for sparse matrices')
+        return sparse.csr_array((self.data, (self.rows, self.columns)), shape=self.shape)
+
+    def toarray(self):
+        """Return the incidence matrix as a dense array."""
+        array = np.zeros(self.shape, dtype=np.int8)
+        array[self.rows, self.columns] = self.data
+        return array
+
+    def outlets(self):
+        """Return a sparse boolean mask of outlet entries as COO arrays."""
+        mask = (self.data & self.OUTLET).astype(bool)
+        return self.rows[mask], self.columns[mask]
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {self.shape[0]} phenomena x "
+                f"{self.shape[1]} variables, {self.nnz} nonzeros>")
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from .variable import Variable, FunctionCall
+from .term import Term
+from .evaluation import is_reduction, flatten, get_variables
+from .compiler import ResidualCompiler, state_source, broadcast_shapes, unwrap, batch
+try:
+    from scipy import sparse
+except ImportError: # pragma: no cover
+    sparse = None
+
+__all__ = ('JacobianFunction', 'numerical_partials')
+
+#: Kinds of derivatives by variables. Diagonal derivatives of variables by
+#: chemical only have elements for the same chemical. Dense derivatives
+#: have the shape of the quantity followed by the shape of the variable.
+DIAGONAL = 'diagonal'
+DENSE = 'dense'
+
+def expand(value, ndim):
+    # Append axes so that values broadcast with dense derivatives by
+    # variables with ndim dimensions.
+    value = np.asarray(value)
+    return value.reshape(value.shape + (1,) * ndim)
+
+def densify(derivative, shape, size):
+    # Return the dense form of a diagonal derivative.
+    return np.broadcast_to(derivative, shape)[..., None] * np.eye(size)
+
+def chain(partial, derivative, ndim):
+    return np.tensordot(partial, derivative, axes=ndim)
+
+def partials(functions, derivatives, name, *parameters):
+    if name in derivatives:
+        return derivatives[name](*parameters)
+    else:
+        return numerical_partials(functions[name], *parameters)
+
+def numerical_partials(function, *parameters, step=1e-6):
+    """
+    Return the partial derivatives of a function with respect to each of
+    its parameters by forward finite differences. Each partial derivative
+    has the shape of the value followed by the shape of the parameter. If
+    the function returns several values, a list of partial derivatives is
+    returned for each value.
+
+    """
+    parameters = [np.asarray(i, dtype=float) for i in parameters]
+    values = function(*parameters)
+    several = isinstance(values, tuple)
+    if not several: values = (values,)
+    values = [np.asarray(i, dtype=float) for i in values]
+    results = [[] for i in values]
+    for n, parameter in enumerate(parameters):
+        partials = [np.empty(i.shape + parameter.shape) for i in values]
+        for index in np.ndindex(parameter.shape):
+            perturbed = parameter.copy()
+            h = step * max(abs(float(parameter[index])), 1.)
+            perturbed[index] += h
+            new_values = function(*parameters[:n], perturbed, *parameters[n + 1:])
+            if not several: new_values = (new_values,)
+            for partial, value, new_value in zip(partials, values, new_values):
+                partial[(..., *index)] = (np.asarray(new_value) - value) / h
+        for i, j in zip(results, partials): i.append(j)
+    return results if several else results[0]
+
+
+class JacobianCompiler(ResidualCompiler):
+    # Generates Python source code of Jacobian functions through symbolic
+    # differentiation. Derivatives are given as source code and kind.
+    __slots__ = ('slices', 'rows', 'columns', 'nnz')
+
+    def __init__(self, names, shapes, lines, slices):
+        super().__init__(names, shapes, lines)
+        self.slices = slices # Slices of state variables
+        self.rows = []
+        self.columns = []
+        self.nnz = 0
+
+    def dense(self, derivative, variable, shape):
+        source, kind = derivative
+        if kind == DENSE: return derivative
+        variable_shape = self.shapes[variable]
+        if shape is None: shape = variable_shape
+        return f"densify({source}, {shape!r}, {variable_shape[0]})", DENSE
+
+    def broadcasted(self, derivative, variable, shape):
+        # Diagonal derivatives become dense when quantities broadcast
+        # beyond the shape of the variable.
+        if (derivative is not None and derivative[1] == DIAGONAL
+            and shape is not None and shape != self.shapes[variable]):
+            derivative = self.dense(derivative, variable, shape)
+        return derivative
+
+    def add(self, left, right, variable, shape, sign='+'):
+        if left is None:
+            if right is None or sign == '+': return right
+            source, kind = right
+            return f"(-{source})", kind
+        elif right is None:
+            return left
+        if left[1] != right[1]:
+            left = self.dense(left, variable, shape)
+            right = self.dense(right, variable, shape)
+        return f"({left[0]} {sign} {right[0]})", left[1]
+
+    def scale(self, derivative, value, ndim):
+        source, kind = derivative
+        if kind == DENSE and ndim: value = f"expand({value}, {ndim})"
+        return f"({source} * {value})", kind
+
+    def derivative(self, quantity, variable):
+        # Return the derivative of a quantity by a state variable (None if
+        # the quantity does not depend on the variable).
+        quantity = unwrap(quantity)
+        if isinstance(quantity, Variable):
+            if quantity is not variable: return None
+            shape = self.shapes[variable]
+            if not shape:
+                return '1.', DENSE
+            elif len(shape) == 1:
+                return '1.', DIAGONAL
+            else:
+                return f"np.eye({int(np.prod(shape))}).reshape({shape + shape!r})", DENSE
+        elif isinstance(quantity, Term):
+            left = quantity.left
+            right = quantity.right
+            dleft = self.derivative(left, variable)
+            dright = self.derivative(right, variable)
+            if dleft is None and dright is None: return None
+            shape = self.shape(quantity)
+            ndim = len(self.shapes[variable])
+            operator = quantity.operator
+            if operator in ('+', '-'):
+                derivative = self.add(dleft, dright, variable, shape, operator)
+            else:
+                L = self.expression(left)
+                R = self.expression(right)
+                if operator == '·':
+                    dleft = dleft and self.scale(dleft, R, ndim)
+                    dright = dright and self.scale(dright, L, ndim)
+                    derivative = self.add(dleft, dright, variable, shape)
+                elif operator == '/':
+                    dleft = dleft and self.scale(dleft, f"(1 / {R})", ndim)
+                    dright = dright and self.scale(dright, f"({L} / {R} ** 2)", ndim)
+                    derivative = self.add(dleft, dright, variable, shape, '-')
+                elif operator == '^':
+                    dleft = dleft and self.scale(dleft, f"({R} * {L} ** ({R} - 1))", ndim)
+                    dright = dright and self.scale(dright, f"({L} ** {R} * np.log({L}))", ndim)
+                    derivative = self.add(dleft, dright, variable, shape)
+                else:
+                    raise ValueError(f"invalid operator {operator!r}")
+            return self.broadcasted(derivative, variable, shape)
+        elif isinstance(quantity, FunctionCall):
+            function = quantity.function
+            name = function.name
+            parameters = flatten(quantity.parameters)
+            derivatives = [self.derivative(i, variable) for i in parameters]
+            if not any(derivatives): return None
+            shape = self.shape(quantity)
+            ndim = len(self.shapes[variable])
+            derivative = None
+            if name == 'Σ':
+                reduction = is_reduction(function)
+                for parameter, i in zip(parameters, derivatives):
+                    if i is None: continue
+                    if reduction: i = self.reduced(i, parameter, variable)
+                    derivative = self.add(derivative, i, variable, shape)
+            elif name == 'Π':
+                if is_reduction(function):
+                    raise ValueError(f"cannot differentiate {quantity}")
+                values = [self.expression(i) for i in parameters]
+                for n, i in enumerate(derivatives):
+                    if i is None: continue
+                    others = ' * '.join([j for m, j in enumerate(values) if m != n]) or '1.'
+                    derivative = self.add(derivative, self.scale(i, f"({others})", ndim), variable, shape)
+            elif name == 'min' and len(parameters) == 1:
+                derivative = derivatives[0]
+            elif name == 'min':
+                values = [self.expression(i) for i in parameters]
+                selection = self.temporary(
+                    f"np.argmin(np.broadcast_arrays({', '.join(values)}), axis=0)"
+                )
+                for n, i in enumerate(derivatives):
+                    if i is None: continue
+                    derivative = self.add(derivative, self.scale(i, f"({selection} == {n})", ndim), variable, shape)
+            else:
+                return self.chain(quantity, derivatives, variable)
+            return self.broadcasted(derivative, variable, shape)
+        else:
+            return None
+
+    def reduced(self, derivative, parameter, variable):
+        # Return the derivative of a sum over chemicals.
+        source, kind = derivative
+        variable_shape = self.shapes[variable]
+        if kind == DIAGONAL:
+            return f"np.broadcast_to({source}, {variable_shape!r})", DENSE
+        shape = self.shape(parameter)
+        if shape is not None: source = f"np.broadcast_to({source}, {shape + variable_shape!r})"
+        return f"np.sum({source}, axis={-1 - len(variable_shape)})", DENSE
+
+    def chain(self, quantity, derivatives, variable, index=None):
+        # Return the derivative of a function call by the chain rule.
+        parameters = flatten(quantity.parameters)
+        values = ', '.join([self.expression(i) for i in parameters])
+        name = quantity.function.name
+        source = self.temporary(f"partials(functions, derivatives, {name!r}, {values})")
+        if index is not None: source = f"{source}[{index}]"
+        variable_shape = self.shapes[variable]
+        derivative = None
+        for n, (parameter, i) in enumerate(zip(parameters, derivatives)):
+            if i is None: continue
+            partial = f"{source}[{n}]"
+            shape = self.shape(parameter)
+            i_source, kind = i
+            if kind == DIAGONAL:
+                i = f"({partial} * {i_source})", DENSE
+            else:
+                if shape is None:
+                    shape = ()
+                else:
+                    i_source = f"np.broadcast_to({i_source}, {shape + variable_shape!r})"
+                i = f"chain({partial}, {i_source}, {len(shape)})", DENSE
+            derivative = self.add(derivative, i, variable, None)
+        return derivative
+
+    def residual(self, left, right, index=None):
+        # Add the source code of the derivatives of the residual by all
+        # state variables.
+        if index is None:
+            shape = broadcast_shapes([self.shape(left), self.shape(right)]) or ()
+        else:
+            shape = self.shape(left)
+            right = unwrap(right)
+            if not isinstance(right, FunctionCall):
+                raise TypeError(f"cannot differentiate {type(right).__name__!r} objects")
+        start = self.size
+        self.size = start + int(np.prod(shape))
+        for variable in {i: None for i in get_variables([left, right])}:
+            if variable not in self.slices: continue
+            dleft = self.derivative(left, variable)
+            if index is None:
+                dright = self.derivative(right, variable)
+            else:
+                derivatives = [self.derivative(i, variable) for i in flatten(right.parameters)]
+                dright = self.chain(right, derivatives, variable, index) if any(derivatives) else None
+            derivative = self.add(dleft, dright, variable, shape, '-')
+            if derivative is not None: self.entries(start, shape, variable, derivative)
+
+    def entries(self, start, shape, variable, derivative):
+        # Add the source code and sparsity pattern of a block of the Jacobian.
+        variable_shape = self.shapes[variable]
+        if derivative[1] == DIAGONAL and shape != variable_shape:
+            derivative = self.dense(derivative, variable, shape)
+        source, kind = derivative
+        columns = self.slices[variable]
+        size = int(np.prod(shape))
+        first = self.nnz
+        if kind == DIAGONAL:
+            self.rows.append(np.arange(start, start + size))
+            self.columns.append(np.arange(columns.start, columns.stop))
+            last = self.nnz = first + size
+            self.lines.append(f"    data[{first}:{last}] = {source}")
+        else:
+            variable_size = columns.stop - columns.start
+            self.rows.append(np.repeat(np.arange(start, start + size), variable_size))
+            self.columns.append(np.tile(np.arange(columns.start, columns.stop), size))
+            last = self.nnz = first + size * variable_size
+            if last - first == 1:
+                self.lines.append(f"    data[{first}] = {source}")
+            else:
+                self.lines.append(
+                    f"    data[{first}:{last}] = np.broadcast_to({source}, {shape + variable_shape!r}).ravel()"
+                )
+
+
+class JacobianFunction:
+    """
+    Create a JacobianFunction object which compiles the analytic Jacobian
+    of a residual function through symbolic differentiation. Derivatives
+    of callbacks (e.g., 'H', 'BubblePoint') are applied through the chain
+    rule. The sparsity pattern follows the incidence of variables in
+    equations and is computed once, so each call only evaluates the
+    nonzero entries.
+
+    Parameters
+    ----------
+    residuals : ResidualFunction
+        Compiled residuals of equations.
+    derivatives : Mapping[str, Callable], optional
+        Partial derivatives of functions by name. Each callable takes the
+        parameters of the function and returns the partial derivatives
+        with respect to each parameter (see `numerical_partials`).
+        Functions without derivatives are differentiated numerically.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> residuals = phn.ResidualFunction(phn.StageVLE(), n_chemicals=2)
+    >>> jacobian = phn.JacobianFunction(residuals)
+    >>> jacobian.shape, jacobian.nnz
+    ((24, 37), 91)
+
+    The Jacobian matches forward differences of the residuals, both with 
+    analytic derivatives of callbacks and with numerical ones:
+
+    >>> import numpy as np
+    >>> functions = {
+    ...     'H': lambda F, T, P: F.sum(-1) * (T - 300.),
+    ...     'C': lambda F, T, P: F.sum(-1),
+    ... }
+    >>> derivatives = {'H': lambda F, T, P: (np.full(F.shape, T - 300.), F.sum(-1), 0.)}
+    >>> residuals = phn.ResidualFunction(phn.Mixer(), 2, functions=functions)
+    >>> x = np.random.default_rng(0).uniform(1., 2., residuals.size)
+    >>> differences = np.array([
+    ...     (residuals(x + 1e-6 * i) - residuals(x)) / 1e-6 for i in np.eye(x.size)
+    ... ]).T
+    >>> for jacobian in (phn.JacobianFunction(residuals, derivatives),
+    ...                  phn.JacobianFunction(residuals)):
+    ...     A = jacobian(x)
+    ...     A = A.toarray() if hasattr(A, 'toarray') else A # Sparse with scipy
+    ...     print(np.allclose(A, differences, atol=1e-4))
+    True
+    True
+
+    """
+    __slots__ = (
+        'residuals', 'derivatives', 'rows', 'columns', 'order',
+        'indptr', 'indices', 'shape', 'source', 'function',
+    )
+
+    def __init__(self, residuals, derivatives=None):
+        names, lines = state_source(residuals.variables, residuals.shapes, residuals.fixed)
+        compiler = JacobianCompiler(names, residuals.shapes, lines, residuals.slices)
+        header = len(lines)
+        for i in residuals.equations: compiler.equation(i)
+        source = '\n'.join([
+            "def jacobian(x, p, functions, derivatives, data):",
+            *lines[:header],
+            *compiler.batch_lines(),
+            *lines[header:],
+            "    return data",
+        ])
+        namespace = {
+            'np': np, 'expand': expand, 'densify': densify,
+            'chain': chain, 'partials': partials, 'batch': batch,
+        }
+        exec(compile(source, f"<jacobian of {residuals.phenomenode}>", 'exec'), namespace)
+        rows = np.concatenate([np.zeros(0, dtype=np.intp), *compiler.rows])
+        columns = np.concatenate([np.zeros(0, dtype=np.intp), *compiler.columns])
+        shape = (residuals.n_residuals, residuals.size)
+        order = np.lexsort((columns, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        self.residuals = residuals
+        self.derivatives = {} if derivatives is None else dict(derivatives)
+        self.rows = rows
+        self.columns = columns
+        self.order = order
+        self.indptr = indptr
+        self.indices = columns[order]
+        self.shape = shape
+        self.source = source
+        self.function = namespace['jacobian']
+
+    @property
+    def nnz(self):
+        """[int] Number of structural nonzeros."""
+        return self.rows.size
+
+    def values(self, x):
+        """Return the values of nonzero entries (in the order of `rows`
+        and `columns`) at state vector `x`."""
+        residuals = self.residuals
+        return self.function(
+            x, residuals.parameter_values(), residuals.functions,
+            self.derivatives, np.empty(self.nnz)
+        )
+
+    def __call__(self, x):
+        """Return the Jacobian at state vector `x` as a sparse matrix in
+        compressed sparse row format (or a dense array if scipy is not
+        installed)."""
+        data = self.values(x)
+        if sparse is None:
+            array = np.zeros(self.shape)
+            array[self.rows, self.columns] = data
+            return array
+        return sparse.csr_array((data[self.order], self.indices, self.indptr), shape=self.shape)
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {self.shape[0]} residuals x "
+                f"{self.shape[1]} states, {self.nnz} nonzeros>")
@@ -6,10 +6,12 @@ from .variable import Variable, index as I
 from .context import ContextItem, ContextStack, Contexts
 from .gate import Inlets, Outlets
 from .registry import Registry
+from .varnode import VarNode, graph_versions
 from .graphics import PhenomeNodeGraphics
 from .utils import AbstractMethod
 from .stream import Stream, as_streams
 from typing import Optional, Mapping, Callable
+from weakref import WeakSet
 
 __all__ = ('PhenomeNode',)
 
@@ -76,6 +78,27 @@ def default_variables(variables, default_sequence):
                 raise ValueError('inlets and outlets must be variables or variable nodes')
         return new_variables
 
+#: [WeakSet[PhenomeNode]] Lazy units with pending phenomena.
+pending_units = WeakSet()
+
+def load_pending_units(streams):
+    # Loading may realias the variable nodes of streams, so lazy units must 
+    # be loaded before other units use their streams (as in eager loading).
+    if not pending_units:
+        return
+    elif isinstance(streams, Stream): 
+        streams = [streams]
+    elif not isinstance(streams, (list, tuple)): 
+        return
+    pending = []
+    for stream in streams:
+        if not isinstance(stream, Stream): continue
+        for varnode in stream.varnodes:
+            for unit in (*varnode.sources, *varnode.sinks):
+                if unit._pending and unit not in pending: pending.append(unit)
+    for unit in pending:
+        if unit._pending: unit._load_pending_phenomena()
+
 class PhenomeNode(ContextItem, tag='n'):
     registry = Registry()
     
@@ -103,6 +126,13 @@ class PhenomeNode(ContextItem, tag='n'):
     #: [bool] Whether equation is linear.
     linear = None
     
+    #: [bool] Whether to defer loading phenomena until they are first accessed.
+    lazy = False
+    
+    _pending = False
+    
+    _nested_phenomena = None
+    
     def __init_subclass__(cls, tag=None):
         if 'priority' not in cls.__dict__: cls.priority += 1
         name = cls.__name__
@@ -115,7 +145,6 @@ class PhenomeNode(ContextItem, tag='n'):
                 raise ValueError('tag must be a (roman or greek) letter')
             cls.tag = tag
             cls.registered_tags.add(tag)
-        cls.tickets[cls.tag] = 0
         if cls.default_ins is not None and not isinstance(cls.default_ins, DefaultSequence):
             if isinstance(cls.default_ins, Mapping):
                 cls.default_ins = DefaultSequence(**cls.default_ins)
@@ -136,23 +165,132 @@ class PhenomeNode(ContextItem, tag='n'):
                 )
         Contexts.append(cls)
         
-    def __new__(cls, ins=None, outs=None, name=None, category=None, subcategory=None, **kwargs):
+    def __new__(cls, ins=None, outs=None, name=None, category=None, subcategory=None, lazy=None, **kwargs):
+        self = cls._new_prepared(ins, outs, name, kwargs)
+        if lazy is None: lazy = cls.lazy
+        if lazy and self.load:
+            # Streams may be realiased directly before loading phenomena
+            self._stream_states = [
+                (i, i.get_state()) for i in (*self.ins, *self.outs) if isinstance(i, Stream)
+            ]
+            self._phenomena = []
+            self._pending = True
+            pending_units.add(self)
+        else:
+            self.registry.open_context_level()
+            self.load()
+            self.phenomena = self.registry.close_context_level()
+        self._finalize_new(category, subcategory)
+        return self
+    
+    def __getattr__(self, name):
+        # Attributes created by `load` are available once phenomena are loaded
+        if self._pending and not name.startswith('_'):
+            self._load_pending_phenomena()
+            return getattr(self, name)
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+    
+    def _load_pending_phenomena(self):
+        self._pending = False
+        pending_units.discard(self)
+        stream_states = [(i, state, i.get_state()) for i, state in self._stream_states]
+        del self._stream_states
+        for i, state, current in stream_states: i.set_state(state)
+        self.registry.open_context_level()
+        self.load()
+        self._phenomena = self.registry.close_context_level()
+        for i, state, current in stream_states:
+            # Keep changes made directly after preparing this node, which 
+            # would have been made after loading phenomena in eager mode
+            i.set_state([
+                new if old is last else last
+                for old, last, new in zip(state, current, i.get_state())
+            ])
+        ancestry = self.ancestry
+        for i in self._iter_loaded_phenomena(): i.ancestry.extend(ancestry)
+        self._reset_flattened_phenomena()
+        self.graph_changed()
+    
+    @property
+    def phenomena(self):
+        """[list[PhenomeNode]] Phenomena within this node. Pending phenomena 
+        of lazy nodes are loaded on first access."""
+        if self._pending: self._load_pending_phenomena()
+        return self._phenomena
+    @phenomena.setter
+    def phenomena(self, phenomena):
+        self._pending = False
+        self._phenomena = phenomena
+    
+    @property
+    def loaded(self):
+        """
+        [bool] Whether phenomena have been loaded.
+
+        Examples
+        --------
+        Lazy units are loaded before other units use their streams, so
+        lazily loaded phenomena are the same as eagerly loaded ones:
+
+        >>> import phenomenode as phn
+        >>> def flowsheet(lazy):
+        ...     with phn.PhenomeNode() as flowsheet:
+        ...         MLLE = phn.MultiStageLLE(n_stages=3, lazy=lazy)
+        ...         assert MLLE.loaded is not lazy
+        ...         phn.MultiStageVLE(ins=[MLLE.outs[0]], n_stages=3, feed_stages=[1], lazy=lazy)
+        ...         assert MLLE.loaded
+        ...     return flowsheet.describe()
+        >>> phn.run_isolated(flowsheet, True) == phn.run_isolated(flowsheet, False)
+        True
+
+        """
+        return not self._pending
+    
+    @property
+    def has_phenomena(self):
+        """[bool] Whether the node has phenomena of its own. Pending 
+        phenomena of lazy nodes are not loaded to answer this."""
+        return self._pending or bool(self._phenomena)
+    
+    def _load_pending_streams(self):
+        # Load pending phenomena of this node and of nodes sharing its 
+        # streams, which may realias the variable nodes of the streams.
+        if not pending_units: return
+        if self._pending: self._load_pending_phenomena()
+        load_pending_units(self.ins.nodes)
+        load_pending_units(self.outs.nodes)
+    
+    def _iter_loaded_phenomena(self):
+        # Iterate over all phenomena within the hierarchy without loading 
+        # pending phenomena.
+        stack = [self]
+        while stack:
+            phenomena = stack.pop()._phenomena
+            if phenomena:
+                yield from phenomena
+                stack.extend(phenomena)
+    
+    @classmethod
+    def _new_prepared(cls, ins, outs, name, kwargs):
         if cls.n_ins is not None:
             ins = [Stream() for i in range(cls.n_ins)] if ins is None else as_streams(ins)
         if cls.n_outs is not None:
             outs = [Stream() for i in range(cls.n_outs)] if outs is None else as_streams(outs)
+        load_pending_units(ins)
+        load_pending_units(outs)
         self = super().__new__(cls, name)
+        self.ancestry = [self]
+        self._graph_version = next(graph_versions)
         self.prepare(ins, outs, **kwargs)
-        self.registry.open_context_level()
-        self.load()
-        self.phenomena = self.registry.close_context_level()
-        for i in self.nested_phenomena: i.ancestry.append(self)
+        return self
+    
+    def _finalize_new(self, category, subcategory):
+        for i in self._iter_loaded_phenomena(): i.ancestry.append(self)
         self.registry.register(self)
-        self.ancestry = [self]
+        self.graph_changed()
         if category is not None: self.category = category
         if subcategory is not None: self.subcategory = subcategory
         if self.category: self.graphics = PhenomeNodeGraphics(self.category, self.subcategory, self.directed, self.linear)
-        return self
     
     def prepare(self, ins, outs, **kwargs):
         """Initialize edges and any additional parameters. 
@@ -171,16 +309,51 @@ class PhenomeNode(ContextItem, tag='n'):
             self, default_variables(outs, self.default_outs)
         )
     
+    def _load_flattened_phenomena(self):
+        nested = []
+        depth = 0
+        stack = [(self, 0)]
+        while stack:
+            node, level = stack.pop()
+            phenomena = node.phenomena
+            if phenomena:
+                nested.extend(phenomena)
+                level += 1
+                stack.extend([(i, level) for i in reversed(phenomena)])
+            elif level > depth:
+                depth = level
+        self._nested_phenomena = tuple(nested)
+        self._leaf_phenomena = tuple([i for i in nested if not i.phenomena])
+        self._depth = depth
+    
+    def _reset_flattened_phenomena(self):
+        for i in self.ancestry: i._nested_phenomena = None
+    
     @property
     def nested_phenomena(self):
-        phenomena = self.phenomena
-        if phenomena:
-            return sum([i.nested_phenomena for i in self.phenomena], phenomena)
-        else:
-            return phenomena
+        """[tuple[PhenomeNode]] All phenomena within the hierarchy, listing 
+        the phenomena of each node before descending into them."""
+        if self._nested_phenomena is None: self._load_flattened_phenomena()
+        return self._nested_phenomena
+    
+    @property
+    def leaf_phenomena(self):
+        """[tuple[PhenomeNode]] All phenomena within the hierarchy that do 
+        not have phenomena of their own."""
+        if self._nested_phenomena is None: self._load_flattened_phenomena()
+        return self._leaf_phenomena
+    
+    def iter_all(self):
+        """Iterate over all phenomena within the hierarchy."""
+        return iter(self.nested_phenomena)
+    
+    def iter_leaves(self):
+        """Iterate over all leaf phenomena within the hierarchy."""
+        return iter(self.leaf_phenomena)
     
     @property
     def varnodes(self):
+        self._load_pending_streams()
         varnodes = [] 
         for i in self.ins + self.outs:
             if hasattr(i, '__iter__'):
@@ -191,6 +364,7 @@ class PhenomeNode(ContextItem, tag='n'):
     
     @property
     def inlet_varnodes(self):
+        self._load_pending_streams()
         varnodes = [] 
         for i in self.ins:
             if hasattr(i, '__iter__'):
@@ -201,6 +375,7 @@ class PhenomeNode(ContextItem, tag='n'):
     
     @property
     def outlet_varnodes(self):
+        self._load_pending_streams()
         varnodes = [] 
         for i in self.outs:
             if hasattr(i, '__iter__'):
@@ -210,6 +385,7 @@ class PhenomeNode(ContextItem, tag='n'):
         return varnodes
     
     def proprietary_varnodes(self, filterkey):
+        self._load_pending_streams()
         varnodes = [] 
         for i in self.outs:
             if hasattr(i, '__iter__'):
@@ -234,13 +410,150 @@ class PhenomeNode(ContextItem, tag='n'):
             else:
                 varnodes.append(i)
         return varnodes
-    
+
     @property
-    def depth(self):
+    def graph_version(self):
+        """
+        [int] Version of the phenomena graph of the outermost node. It
+        changes whenever variable nodes within it are docked or realiased,
+        or phenomena are nested, so that cached numbering and contexts can
+        be invalidated without affecting other graphs.
+
+        Examples
+        --------
+        >>> import phenomenode as phn
+        >>> stage, other = phn.StageVLE(), phn.StageVLE()
+        >>> version, other_version = stage.graph_version, other.graph_version
+        >>> varnode = stage.ins[0].varnodes[0]
+        >>> varnode.variable = varnode.variable
+        >>> stage.graph_version == version, other.graph_version == other_version
+        (False, True)
+
+        """
+        return self.ancestry[-1]._graph_version
+
+    def graph_changed(self):
+        """Invalidate cached numbering and contexts within the outermost
+        node."""
+        self.ancestry[-1]._graph_version = next(graph_versions)
+
+    def get_varnode_numbers(self):
+        """
+        Return a dictionary of variable node numbers by variable node. 
+        
+        Variable nodes that share the same variable and are not connected
+        to unit operations are numbered in the order they appear in leaf 
+        phenomena. Variables that appear only once are not numbered. The
+        index is computed in one pass and cached until the graph changes.
+        
+        """
+        version = self.graph_version
+        try:
+            cached_version, numbers = self._varnode_numbers
+        except AttributeError:
+            pass
+        else:
+            if cached_version == version: return numbers
         if self.phenomena:
-            return 1 + max([i.depth for i in self.phenomena])
+            varnodes = []
+            for i in self.iter_leaves(): varnodes.extend(i.varnodes)
+        else:
+            varnodes = self.varnodes
+        groups = {}
+        visited = set()
+        for i in varnodes:
+            if i in visited: continue
+            visited.add(i)
+            if any([j.has_phenomena for j in (*i.sources, *i.sinks)]): continue
+            variable = i.variable
+            if variable in groups:
+                groups[variable].append(i)
+            else:
+                groups[variable] = [i]
+        numbers = {}
+        for group in groups.values():
+            if len(group) > 1: 
+                for n, i in enumerate(group): numbers[i] = n
+        self._varnode_numbers = (version, numbers)
+        return numbers
+    
+    def get_phenomenon_indices(self):
+        """
+        Return a dictionary of the position of each phenomenon within this
+        node by phenomenon. The index is cached until the graph changes.
+        
+        """
+        version = self.graph_version
+        try:
+            cached_version, indices = self._phenomenon_indices
+        except AttributeError:
+            pass
+        else:
+            if cached_version == version: return indices
+        indices = {j: i for i, j in enumerate(self.phenomena)}
+        self._phenomenon_indices = (version, indices)
+        return indices
+    
+    @property
+    def tag_path(self):
+        """[str] Identifier of the node by its position within the hierarchy
+        of phenomena (e.g., 'm0_s2_e5' for the sixth phenomenon of the third
+        stage of a column). The outermost node is identified by its tag and 
+        name, and each nested node by its tag and position within its parent."""
+        ancestry = self.ancestry
+        root = ancestry[-1]
+        path = [f"{root.tag}{root.name}"]
+        for parent, node in zip(ancestry[:0:-1], ancestry[-2::-1]):
+            path.append(f"{node.tag}{parent.get_phenomenon_indices()[node]}")
+        return '_'.join(path)
+    
+    def compact_graph(self):
+        """
+        Return a read-only CompactGraph object with the structure of the 
+        phenomena hierarchy as integer arrays. The graph is cached until the 
+        graph changes.
+        
+        """
+        version = self.graph_version
+        try:
+            cached_version, graph = self._compact_graph
+        except AttributeError:
+            pass
         else:
-            return 0
+            if cached_version == version: return graph
+        from .compact import CompactGraph # Requires numpy
+        graph = CompactGraph(self)
+        self._compact_graph = (version, graph)
+        return graph
+    
+    def incidence_matrix(self):
+        """
+        Return an IncidenceMatrix object of leaf phenomena by unique framed 
+        variables, with row and column metadata.
+        
+        """
+        from .incidence import IncidenceMatrix # Requires numpy
+        return IncidenceMatrix(self)
+    
+    def block_triangular_form(self, fixed=None):
+        """
+        Return a BlockTriangularForm object which orders leaf phenomena and
+        variables into blocks that can be solved in sequence.
+        
+        Parameters
+        ----------
+        fixed : Iterable[Variable], optional
+            Framed variables that are specified.
+        
+        """
+        from .decomposition import BlockTriangularForm # Requires numpy
+        return BlockTriangularForm(self.incidence_matrix(), fixed)
+    
+    @property
+    def depth(self):
+        """[int] Number of levels of phenomena within the hierarchy."""
+        if self._nested_phenomena is None: self._load_flattened_phenomena()
+        return self._depth
     
     #: Abstract method for loading phenomena. This method is called after `init`
     load = AbstractMethod
@@ -257,16 +570,17 @@ class PhenomeNode(ContextItem, tag='n'):
         else:
             return equations[index + 1:]
     
-    def vizoptions(self):
-        """Return node attributes for graphviz."""
+    def vizoptions(self, tooltip=None):
+        """Return node attributes for graphviz. The tooltip string may be 
+        given to avoid describing the node again."""
         options = self.graphics.get_options(self)
-        options['tooltip'] = self.get_tooltip_string()
+        options['tooltip'] = self.get_tooltip_string() if tooltip is None else tooltip
         return options
 
     def contextualize(self, context):
         if context is None: # First context is trivial
             return ContextStack()
-        elif self.phenomena and not (isinstance(context, ContextStack) and self in context.stack):
+        elif self.has_phenomena and not (isinstance(context, ContextStack) and self in context.stack):
             # Must be a unit operation with internal phenomena
             return self + context
         else: # Must be the phenomenon itself, so it does not need context
@@ -282,7 +596,9 @@ class PhenomeNode(ContextItem, tag='n'):
         if self.phenomena or self.ins or self.outs:
             raise RuntimeError('node was modified before exiting `with` statement')
         self.phenomena = self.registry.close_context_level()
-        for i in self.nested_phenomena: i.ancestry.append(self)
+        self._reset_flattened_phenomena()
+        for i in self._iter_loaded_phenomena(): i.ancestry.append(self)
+        self.graph_changed()
         if exception: raise exception
     
     def _equations_format(self, start):
@@ -363,7 +679,8 @@ class PhenomeNode(ContextItem, tag='n'):
             Format of file.
         display : 
             Whether to display diagram in console or to return the graphviz 
-            object.
+            object. If False, diagrams saved to a file are streamed to the
+            file (see `stream_digraph`).
         
         """
         with phn.preferences.temporary() as pref:
@@ -403,6 +720,8 @@ class PhenomeNode(ContextItem, tag='n'):
                     (directed is None or directed == x.directed) and
                     (exclude_subcategory is None or x.subcategory is None)
                 )
+            if file and not display:
+                return phn.stream_digraph(self, file, format, filterkey, title=str(self), **graph_attrs)
             f = phn.digraph_from_phenomenode(self, filterkey, title=str(self), **graph_attrs)
             if display or file:
                 phn.finalize_digraph(f, file, format)
@@ -51,6 +51,7 @@ class DisplayPreferences:
         'subcategory',
         'overlap',
         'outputs_only',
+        'render_cache',
     )
     
     def __init__(self):
@@ -121,6 +122,10 @@ class DisplayPreferences:
         #: Whether to show only output variables from subgraphs
         self.outputs_only = True
         
+        #: Whether to keep rendered diagrams in an on-disk cache (see 
+        #: `phenomenode.digraph.RenderCache`).
+        self.render_cache = False
+        
         #: Displayed height of graphviz html diagrams without and with full results.
         self.graphviz_html_height: dict[str, tuple[str, str]] = {
             'big-network': ('600px', '900px'),
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from math import ceil, log2
+from collections import OrderedDict
+from collections.abc import Mapping
+
+__all__ = ('PropertyPackage',)
+
+def cache_keys(parameters, bits):
+    # Return hashable keys of calls (given as parameters stacked along a
+    # leading axis) rounded to the given number of significant bits.
+    n_calls = len(parameters[0])
+    columns = []
+    for i in parameters:
+        mantissa, exponent = np.frexp(i.reshape(n_calls, -1))
+        columns.append(np.round(np.ldexp(mantissa, bits)).astype(np.int64))
+        columns.append(exponent.astype(np.int64))
+    keys = np.ascontiguousarray(np.concatenate(columns, axis=1))
+    return keys.view(np.dtype((np.void, keys.shape[1] * keys.itemsize))).ravel().tolist()
+
+def frozen(value):
+    # Return a read-only copy of a value (or of each value of a tuple) so
+    # that cached values cannot be modified in place.
+    if isinstance(value, tuple):
+        return tuple([frozen(i) for i in value])
+    elif isinstance(value, np.ndarray):
+        value = value.copy()
+        value.setflags(write=False)
+        return value
+    else:
+        return value
+
+
+class Property:
+    """
+    Create a Property object which evaluates a function of a property
+    package one call at a time or in batches.
+
+    Parameters
+    ----------
+    package : PropertyPackage
+        Property package that implements the function.
+    name : str
+        Name of function.
+
+    """
+    __slots__ = ('package', 'name')
+
+    def __init__(self, package, name):
+        self.package = package
+        self.name = name
+
+    def __call__(self, *parameters):
+        return self.package.evaluate(self.name, [parameters])[0]
+
+    def batch(self, calls):
+        """Return the values of a sequence of calls (tuples of parameters)."""
+        return self.package.evaluate(self.name, calls)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.name}>"
+
+
+class PropertyPackage(Mapping):
+    """
+    Create a PropertyPackage object which provides thermodynamic functions
+    (e.g., 'H', 'C', 'BubblePoint', 'PseudoEquilibrium', 'G') to numerical
+    methods. Subclasses implement each function as a method of the same
+    name which takes parameters stacked along a leading axis (one row per
+    call) and returns values stacked the same way (or a tuple of such
+    arrays for functions with several values). Functions that can only be
+    evaluated one call at a time may also be given by name.
+
+    Property packages are mappings of functions by name, so they can be
+    used wherever functions are expected (e.g., `PhenomenaSolver`,
+    `EvaluationPlan`, and `ResidualFunction`). Compiled residual functions
+    evaluate all calls of a function (e.g., enthalpies of every stream of
+    a column) in a single batch.
+
+    Values are kept in a least recently used cache keyed on parameters
+    rounded to a relative tolerance. Extensive functions (e.g., 'H' and
+    'C') are evaluated at the composition of the flow rates given as their
+    first parameter and scaled by the total flow rate, so that streams at
+    similar temperature, pressure, and composition share cache entries
+    across stages and iterations. Cached arrays are read-only copies and
+    are returned as is, so values must not be modified in place.
+
+    Parameters
+    ----------
+    functions : Mapping[str, Callable], optional
+        Functions by name which are evaluated one call at a time.
+    tolerance : float, optional
+        Relative tolerance of cache keys. Defaults to 1e-9. Must be well
+        below the relative step of finite differences (e.g., 1e-6 in 
+        `FiniteDifferenceJacobian`); otherwise, both perturbations of a 
+        step may share a cache entry, resulting in zero derivatives.
+    maxsize : int, optional
+        Maximum number of cached values. Defaults to 10000.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import phenomenode as phn
+    >>> package = phn.PropertyPackage({'H': lambda F, T, P: F.sum() * (T - 300.)})
+    >>> H = package['H']
+    >>> float(H(np.array([1., 1.]), 350., 101325.))
+    100.0
+    >>> float(H(np.array([2., 2.]), 350., 101325.))
+    200.0
+    >>> package.hits, package.misses
+    (1, 1)
+    >>> K = phn.PropertyPackage({'K': lambda T: np.array([1., 2.]) * T})['K']
+    >>> K(350.).flags.writeable
+    False
+
+    Methods of subclasses evaluate all calls missing in the cache in a
+    single batch. Calls within the tolerance share cache entries:
+
+    >>> class IdealPackage(phn.PropertyPackage):
+    ...     __slots__ = ()
+    ...     def K(self, T): return np.array([1., 2.]) * T[:, None] / 300.
+    >>> package = IdealPackage()
+    >>> calls = [(300.,), (350.,), (300.,)]
+    >>> values = package['K'].batch(calls)
+    >>> np.allclose(values, [np.array([1., 2.]) * T / 300. for T, in calls])
+    True
+    >>> package.hits, package.misses
+    (1, 2)
+    >>> K = package['K']
+    >>> K(300. * (1 + 1e-12)) is values[0], K(300. * (1 + 1e-6)) is values[0]
+    (True, False)
+
+    """
+    __slots__ = ('functions', 'tolerance', 'maxsize', 'cache', 'hits', 'misses', '_bits')
+
+    #: tuple[str] Names of functions which are extensive in the flow rates
+    #: given as their first parameter.
+    extensive = ('H', 'C')
+
+    def __init__(self, functions=None, tolerance=1e-9, maxsize=10000):
+        self.functions = {} if functions is None else dict(functions)
+        self.tolerance = tolerance
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._bits = ceil(-log2(tolerance))
+
+    def __getitem__(self, name):
+        if name not in self: raise KeyError(name)
+        return Property(self, name)
+
+    def __contains__(self, name):
+        return name in self.functions or (
+            isinstance(name, str)
+            and not name.startswith('_')
+            and hasattr(type(self), name)
+            and not hasattr(PropertyPackage, name)
+        )
+
+    def __iter__(self):
+        yield from self.functions
+        for name in dir(type(self)):
+            if name not in self.functions and name in self: yield name
+
+    def __len__(self):
+        return sum([1 for i in self])
+
+    def evaluate(self, name, calls):
+        """Return the values of a function for a sequence of calls (tuples
+        of parameters). Only calls missing in the cache are evaluated."""
+        n_calls = len(calls)
+        if not n_calls: return []
+        try:
+            parameters = [np.stack([np.asarray(i, dtype=float) for i in j]) for j in zip(*calls)]
+        except ValueError: # Parameters of different shapes
+            return [self.evaluate(name, [i])[0] for i in calls]
+        extensive = name in self.extensive
+        if extensive:
+            flows = parameters[0]
+            scales = flows.reshape([n_calls, -1]).sum(axis=1)
+            totals = np.where(scales, scales, 1.)
+            parameters[0] = flows / totals.reshape([n_calls] + [1] * (flows.ndim - 1))
+        cache = self.cache
+        shapes = tuple([i.shape[1:] for i in parameters])
+        values = [None] * n_calls
+        missing = {} # Indices of calls by key
+        for n, key in enumerate(cache_keys(parameters, self._bits)):
+            key = (name, shapes, key)
+            if key in cache:
+                cache.move_to_end(key)
+                values[n] = cache[key]
+                self.hits += 1
+            elif key in missing:
+                missing[key].append(n)
+                self.hits += 1
+            else:
+                missing[key] = [n]
+        if missing:
+            self.misses += len(missing)
+            rows = [i[0] for i in missing.values()]
+            arguments = [i[rows] for i in parameters]
+            for (key, indices), value in zip(missing.items(), self._compute(name, arguments)):
+                cache[key] = value = frozen(value)
+                for i in indices: values[i] = value
+            while len(cache) > self.maxsize: cache.popitem(last=False)
+        if extensive: values = [i * j for i, j in zip(values, scales.tolist())]
+        return values
+
+    def _compute(self, name, parameters):
+        if name in self.functions:
+            function = self.functions[name]
+            return [function(*i) for i in zip(*parameters)]
+        values = getattr(self, name)(*parameters)
+        if isinstance(values, tuple):
+            return [tuple([j[i] for j in values]) for i in range(len(parameters[0]))]
+        else:
+            return list(values)
+
+    def clear(self):
+        """Clear cache."""
+        self.cache.clear()
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {len(self.cache)} cached values, "
+                f"{self.hits} hits, {self.misses} misses>")
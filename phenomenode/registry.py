@@ -1,48 +1,132 @@
 # -*- coding: utf-8 -*-
 """
 """
-import phenomenode as phn
+from contextvars import ContextVar, Context
+from .context import get_tickets, set_tickets
+from .utils import get_owner
 
-__all__ = ('Registry',)
+__all__ = ('Registry', 'run_isolated')
+
+def run_isolated(function, *args, **kwargs):
+    """
+    Call function within a new, empty context, so that registries and 
+    ticket counters start fresh. Building units with this function yields
+    deterministic names regardless of what else was built in the same
+    thread.
+    
+    Threads and asyncio tasks build in isolation from each other, but pools
+    of threads (e.g., `concurrent.futures.ThreadPoolExecutor`) run all tasks
+    of a worker in the same thread and context. Submit builds through this 
+    function (or `contextvars.copy_context().run`) so that naming does not
+    depend on which worker runs them.
+    
+    """
+    return Context().run(function, *args, **kwargs)
+
+
+class RegistryState:
+    __slots__ = ('owner', 'contexts', 'members', 'context_levels')
+    
+    def __init__(self, contexts):
+        self.owner = get_owner()
+        self.contexts = contexts
+        self.members = set(contexts)
+        self.context_levels = []
+    
+    def copy(self):
+        new = RegistryState(self.contexts.copy())
+        new.context_levels = [
+            [contexts.copy(), members.copy(), tickets.copy()]
+            for contexts, members, tickets in self.context_levels
+        ]
+        return new
+        
 
 class Registry:
-    __slots__ = ('contexts', 'context_levels')
+    """
+    Create a Registry object which keeps track of objects registered at each
+    context level. The state of the registry is local to the current context 
+    (see `contextvars`). State inherited from another thread or asyncio task
+    is copied on first use, so that separate threads and tasks can build 
+    phenomena at the same time.
+    
+    """
+    __slots__ = ('state',)
         
     def __init__(self, contexts=None):
-        self.context_levels = []
-        self.contexts = [] if contexts is None else contexts
-        
+        self.state = ContextVar('registry', default=None)
+        if contexts is not None: self.state.set(RegistryState(contexts))
+    
+    def get_state(self):
+        """Return registry state of the current context."""
+        state = self.state.get()
+        if state is None:
+            state = RegistryState([])
+            self.state.set(state)
+        elif state.owner != get_owner():
+            state = state.copy()
+            self.state.set(state)
+        return state
+    
+    @property
+    def contexts(self):
+        return self.get_state().contexts
+    
+    @property
+    def members(self):
+        return self.get_state().members
+    
+    @property
+    def context_levels(self):
+        return self.get_state().context_levels
+    
     def register(self, obj):
         """Register object without warnings or checks."""
-        if obj not in self.contexts:
-            self.contexts.append(obj)
+        state = self.get_state()
+        members = state.members
+        if obj not in members:
+            members.add(obj)
+            state.contexts.append(obj)
     
     def open_context_level(self):
-        contexts = self.contexts
-        tickets = phn.ContextItem.tickets
-        old_tickets = tickets.copy()
-        for i in tickets: tickets[i] = 0
-        self.contexts = []
-        self.context_levels.append([contexts, old_tickets])
+        state = self.get_state()
+        state.context_levels.append(
+            [state.contexts, state.members, get_tickets()]
+        )
+        state.contexts = []
+        state.members = set()
+        set_tickets({})
         
     def close_context_level(self):
-        contexts = self.contexts
-        self.contexts, old_tickets = self.context_levels.pop()
-        phn.ContextItem.tickets = old_tickets
+        state = self.get_state()
+        contexts = state.contexts
+        state.contexts, state.members, old_tickets = state.context_levels.pop()
+        set_tickets(old_tickets)
         return contexts
     
+    @property
+    def context_sizes(self):
+        """[list[int]] Number of objects registered at each context level,
+        from the outermost to the current level."""
+        state = self.get_state()
+        return [len(i[0]) for i in state.context_levels] + [len(state.contexts)]
+    
     def __contains__(self, obj):
-        obj in self.contexts
+        return obj in self.get_state().members
+    
+    def __len__(self):
+        return len(self.get_state().contexts)
     
     def __iter__(self):
-        return iter(self.contexts)
+        return iter(self.get_state().contexts)
     
     def __repr__(self):
         return f"{type(self).__name__}([{', '.join([repr(i) for i in self])}])"
     
     def show(self):
-        if self.contexts:
-            print(f'{type(self).__name__}:\n' + '\n'.join([str(i) for i in self]))
+        contexts = self.get_state().contexts
+        if contexts:
+            print(f'{type(self).__name__}:\n' + '\n'.join([str(i) for i in contexts]))
         else:
             print(f'{type(self).__name__}: (Empty)')
     
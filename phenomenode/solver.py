@@ -0,0 +1,613 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+from .variable import Variable
+from .quantity import Quantities
+from .evaluation import flatten, get_variables
+from .compiler import AssignmentCompiler
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+    from scipy.linalg import solve_banded
+except ImportError: # pragma: no cover
+    sparse = None
+
+__all__ = ('LinearBlock', 'NonlinearBlock', 'ExplicitUpdate', 'PhenomenaSolver')
+
+def framed_variables(variables):
+    return [i for i in flatten(variables) if isinstance(i, Variable)]
+
+def bandwidths(pattern):
+    # Return the lower and upper bandwidths of a pattern (a list of column 
+    # indices by row).
+    lower = upper = 0
+    for row, columns in enumerate(pattern):
+        for column in columns:
+            if row - column > lower: lower = row - column
+            elif column - row > upper: upper = column - row
+    return lower, upper
+
+def call(function, values, functions):
+    # Call a compiled step function for a single scenario.
+    try:
+        return function(values, {} if functions is None else functions, ())
+    except KeyError as error:
+        variable, = error.args
+        if isinstance(variable, Variable):
+            raise KeyError(f"no value for variable {variable}") from None
+        raise
+
+def name(phenomenon):
+    return f"{type(phenomenon).__name__}({phenomenon:n})"
+
+def max_change(old, new):
+    # Return the maximum relative change of a value (NaN if not finite).
+    new = np.asarray(new, dtype=float)
+    if not np.isfinite(new).all(): return np.nan
+    if old is None: return np.inf
+    old = np.asarray(old, dtype=float)
+    if old.shape != new.shape: return np.inf
+    scale = np.maximum(np.abs(new), 1.)
+    return float((np.abs(new - old) / scale).max(initial=0.))
+
+def largest(changes):
+    # Return the largest change (NaN if any change is NaN).
+    return float(np.max(changes, initial=0.))
+
+
+class LinearBlock:
+    """
+    Create a LinearBlock object of undirected linear phenomena of the same
+    category that are solved simultaneously for the outlet variables of
+    the phenomena. Variables may be arrays (e.g., by chemical), in which
+    case an independent system is solved for each element.
+    
+    Phenomena of multistage units are ordered stage by stage, so equations
+    usually only couple unknowns of neighbouring stages. If the coefficient
+    matrix is banded in this order, all elements are solved at once through
+    a banded LU factorization at a cost proportional to the number of 
+    stages. Otherwise, the system is solved as a general sparse matrix.
+
+    Parameters
+    ----------
+    category : str
+        Category of phenomena.
+    phenomena : Iterable[PhenomeNode]
+        Linear phenomena.
+    max_bandwidth : int, optional
+        Maximum bandwidth of systems solved as banded matrices. Defaults 
+        to 8.
+
+    Examples
+    --------
+    The material balances of a liquid-liquid extraction column couple
+    neighbouring stages, so they are solved as a banded system. The 
+    solution is the same as that of the dense system:
+    
+    >>> import numpy as np
+    >>> import phenomenode as phn
+    >>> from phenomenode.compiler import default_shape
+    >>> solver = phn.PhenomenaSolver(phn.MultiStageLLE(n_stages=5))
+    >>> block = solver.blocks[1]
+    >>> block
+    <LinearBlock: material, 10 equations>
+    >>> rng = np.random.default_rng(0)
+    >>> values = {i: rng.uniform(0.5, 2., default_shape(i, 2)) for i in block.inputs}
+    >>> A, b, shape = block.assemble(values)
+    >>> A = A.toarray() if hasattr(A, 'toarray') else A # Sparse with scipy
+    >>> x = np.linalg.solve(A, b).reshape(len(block.variables), *shape)
+    >>> _ = block.solve(values)
+    >>> block.banded, block.bandwidths
+    (True, (1, 2))
+    >>> bool(np.allclose([values[i] for i in block.variables], x))
+    True
+    
+    """
+    __slots__ = ('category', 'phenomena', 'variables', 'unknowns', 'equations',
+                 'bandwidths', 'max_bandwidth', '_compiled')
+
+    def __init__(self, category, phenomena, max_bandwidth=8):
+        self.category = category
+        self.max_bandwidth = max_bandwidth
+        self.phenomena = phenomena = tuple(phenomena)
+        unknowns = {}
+        producers = {}
+        for i in phenomena:
+            for j in framed_variables(i.outlet_variables()):
+                if j in producers:
+                    producers[j].append(i)
+                else:
+                    unknowns[j] = len(unknowns)
+                    producers[j] = [i]
+        self.unknowns = unknowns
+        self.variables = tuple(unknowns)
+        self.equations = tuple([j for i in phenomena for j in i.equations()])
+        self.bandwidths = None
+        self._compiled = None
+        if len(self.equations) != len(unknowns):
+            shared = [
+                f"{i} is an outlet of {' and '.join([name(k) for k in j])}"
+                for i, j in producers.items() if len(j) > 1
+            ]
+            raise ValueError(
+                f"{category} block of {', '.join([name(i) for i in phenomena])} "
+                f"has {len(self.equations)} equations for {len(unknowns)} "
+                f"unknowns" + (f" ({'; '.join(shared)})" if shared else "")
+            )
+
+    @property
+    def inputs(self):
+        """[tuple[Variable]] Known variables of the equations."""
+        unknowns = self.unknowns
+        inputs = {}
+        for equation in self.equations:
+            for term in equation.terms:
+                for i in get_variables(term):
+                    if i not in unknowns: inputs[i] = None
+        return tuple(inputs)
+
+    @property
+    def banded(self):
+        """[bool] Whether the system is solved as a banded matrix. Only 
+        known after the first solve."""
+        bandwidths = self.bandwidths
+        return bandwidths is not None and max(bandwidths) <= self.max_bandwidth
+
+    def compile(self):
+        """Return the source code of the coefficients and constant of each
+        equation compiled into a single Python function."""
+        if self._compiled is None:
+            compiler = AssignmentCompiler()
+            unknowns = self.unknowns
+            linear_equations = []
+            for equation in self.equations:
+                left, right = equation.terms
+                coefficients, constant = compiler.linear(left - right, unknowns)
+                coefficients = ', '.join([f"{i}: {j}" for i, j in coefficients.items()])
+                linear_equations.append(f"({{{coefficients}}}, {constant})")
+            self._compiled = compiler.compile(
+                'linearize', [f"    return [{', '.join(linear_equations)}]"],
+                f"<{self.category} block>"
+            )
+        return self._compiled[0]
+
+    def linearize(self, values, functions=None):
+        """Return the coefficients and constant of each equation and the
+        shape of the unknowns."""
+        self.compile()
+        linear_equations = call(self._compiled[1], values, functions)
+        shapes = []
+        for coefficients, constant in linear_equations:
+            shapes.append(np.shape(constant))
+            shapes.extend([np.shape(i) for i in coefficients.values()])
+        if self.bandwidths is None:
+            self.bandwidths = bandwidths([i for i, j in linear_equations])
+        return linear_equations, np.broadcast_shapes(*shapes)
+
+    def assemble(self, values, functions=None):
+        """
+        Return the sparse coefficient matrix, the right hand side, and the
+        shape of the unknowns. Elements of array variables are placed in
+        contiguous rows and columns of each equation and unknown.
+
+        """
+        return self._assemble(*self.linearize(values, functions))
+
+    def assemble_banded(self, values, functions=None):
+        """
+        Return the coefficient matrix in diagonal ordered form (as used by
+        `scipy.linalg.solve_banded`), the right hand side, and the shape of 
+        the unknowns. The independent systems of each element of array 
+        variables are stacked along the diagonal, so that all elements are
+        solved at once without widening the band.
+
+        """
+        return self._assemble_banded(*self.linearize(values, functions))
+
+    def _assemble_banded(self, linear_equations, shape):
+        lower, upper = self.bandwidths
+        N = len(linear_equations)
+        size = int(np.prod(shape))
+        ab = np.zeros((lower + upper + 1, size * N))
+        b = np.empty(size * N)
+        for n, (coefficients, constant) in enumerate(linear_equations):
+            b[n::N] = -np.broadcast_to(constant, shape).ravel()
+            for i, coefficient in coefficients.items():
+                ab[upper + n - i, i::N] += np.broadcast_to(coefficient, shape).ravel()
+        return ab, b, shape
+
+    def _assemble(self, linear_equations, shape):
+        size = int(np.prod(shape))
+        elements = np.arange(size)
+        rows = []
+        columns = []
+        data = []
+        b = np.empty(len(linear_equations) * size)
+        for n, (coefficients, constant) in enumerate(linear_equations):
+            offset = n * size
+            b[offset:offset + size] = -np.broadcast_to(constant, shape).ravel()
+            for i, coefficient in coefficients.items():
+                rows.append(elements + offset)
+                columns.append(elements + i * size)
+                data.append(np.broadcast_to(coefficient, shape).ravel())
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        data = np.concatenate(data).astype(float)
+        N = b.size
+        if sparse is None:
+            A = np.zeros((N, N))
+            np.add.at(A, (rows, columns), data)
+        else:
+            A = sparse.csr_array((data, (rows, columns)), shape=(N, N))
+        return A, b, shape
+
+    def solve(self, values, functions=None):
+        """Solve for the unknowns, update values, and return the maximum
+        relative change."""
+        linear_equations, shape = self.linearize(values, functions)
+        N = len(linear_equations)
+        if sparse is None:
+            A, b, shape = self._assemble(linear_equations, shape)
+            x = np.linalg.solve(A, b).reshape(N, -1)
+        elif self.banded:
+            ab, b, shape = self._assemble_banded(linear_equations, shape)
+            x = solve_banded(self.bandwidths, ab, b, check_finite=False).reshape(-1, N).T
+        else:
+            A, b, shape = self._assemble(linear_equations, shape)
+            x = spsolve(A.tocsc(), b).reshape(N, -1)
+        changes = []
+        for i, variable in enumerate(self.variables):
+            value = x[i].reshape(shape)
+            if not shape: value = float(value)
+            changes.append(max_change(values.get(variable), value))
+            values[variable] = value
+        return largest(changes)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.category}, {len(self.equations)} equations>"
+
+
+class ExplicitUpdate:
+    """
+    Create an ExplicitUpdate object which assigns the outlet variables of a
+    directed phenomenon (or the left hand side of a parameter update) from
+    the other side of its equations.
+
+    Parameters
+    ----------
+    phenomenon : PhenomeNode
+        Phenomenon with explicit equations.
+
+    """
+    __slots__ = ('phenomenon', 'assignments', '_compiled')
+
+    def __init__(self, phenomenon):
+        self.phenomenon = phenomenon
+        self._compiled = None
+        outlets = set(framed_variables(phenomenon.outlet_variables()))
+        assignments = []
+        for equation in phenomenon.equations():
+            left, right = equation.terms
+            if phenomenon.directed:
+                for target, expression in ((left, right), (right, left)):
+                    targets = get_variables(target)
+                    if targets and isinstance(target, (Variable, Quantities)) and outlets.issuperset(targets):
+                        break
+                else:
+                    raise ValueError(f"{name(phenomenon)} has no explicit outlets")
+            elif isinstance(left, Variable):
+                target, expression = left, right
+            else:
+                raise ValueError(f"{name(phenomenon)} cannot be solved explicitly")
+            assignments.append((get_variables(target), expression))
+        self.assignments = tuple(assignments)
+
+    @property
+    def variables(self):
+        """[tuple[Variable]] Assigned variables."""
+        return tuple([j for i, _ in self.assignments for j in i])
+
+    @property
+    def inputs(self):
+        """[tuple[Variable]] Variables used to compute the assigned variables."""
+        return tuple({j: None for _, i in self.assignments for j in get_variables(i)})
+
+    def compile(self):
+        """Return the source code of all assignments compiled into a single
+        Python function."""
+        if self._compiled is None:
+            compiler = AssignmentCompiler()
+            for targets, expression in self.assignments:
+                compiler.assign(targets, expression)
+            self._compiled = compiler.compile('update', (), f"<update of {self.phenomenon}>")
+        return self._compiled[0]
+
+    def solve(self, values, functions=None):
+        """Update values and return the maximum relative change."""
+        self.compile()
+        variables = self.variables
+        old = [values.get(i) for i in variables]
+        call(self._compiled[1], values, functions)
+        return largest([max_change(i, values[j]) for i, j in zip(old, variables)])
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {name(self.phenomenon)}>"
+
+
+class NonlinearBlock:
+    """
+    Create a NonlinearBlock object which solves the equations of an 
+    undirected nonlinear phenomenon (e.g., the Rashford-Rice equation) 
+    for its unknowns through Newton's method with finite difference 
+    derivatives. Current values of the unknowns are the initial guesses.
+
+    Parameters
+    ----------
+    phenomenon : PhenomeNode
+        Undirected nonlinear phenomenon.
+    unknowns : Iterable[Variable]
+        Variables to solve for (one per equation).
+
+    """
+    __slots__ = ('phenomenon', 'variables', 'equations', '_compiled')
+
+    #: [int] Maximum number of Newton iterations per solve.
+    maxiter = 50
+
+    #: [float] Relative step of finite differences.
+    step = 1e-7
+
+    def __init__(self, phenomenon, unknowns):
+        self.phenomenon = phenomenon
+        self.variables = tuple(unknowns)
+        self.equations = tuple(phenomenon.equations())
+        self._compiled = None
+        if len(self.equations) != len(self.variables):
+            raise ValueError(
+                f"{name(phenomenon)} has {len(self.equations)} equations for "
+                f"{len(self.variables)} unknowns ({', '.join([str(i) for i in self.variables])})"
+            )
+
+    @property
+    def inputs(self):
+        """[tuple[Variable]] Known variables of the equations."""
+        unknowns = self.variables
+        return tuple({
+            j: None for i in self.equations for j in get_variables(i.terms)
+            if j not in unknowns
+        })
+
+    def compile(self):
+        """Return the source code of the residuals of all equations 
+        compiled into a single Python function."""
+        if self._compiled is None:
+            compiler = AssignmentCompiler()
+            residuals = []
+            for equation in self.equations:
+                left, right = equation.terms
+                compiler.load(equation.terms)
+                residuals.append(f"{compiler.expression(left)} - {compiler.expression(right)}")
+            self._compiled = compiler.compile(
+                'residuals', [f"    return [{', '.join(residuals)}]"],
+                f"<residuals of {self.phenomenon}>"
+            )
+        return self._compiled[0]
+
+    def residuals(self, values, functions=None):
+        """Return the residuals of all equations as a flat array."""
+        self.compile()
+        residuals = call(self._compiled[1], values, functions)
+        return np.concatenate([np.ravel(i) for i in residuals]).astype(float)
+
+    def solve(self, values, functions=None):
+        """Solve for the unknowns, update values, and return the maximum
+        relative change."""
+        variables = self.variables
+        try:
+            old = [values[i] for i in variables]
+        except KeyError as error:
+            raise KeyError(f"no initial guess for variable {error.args[0]}") from None
+        shapes = [np.shape(i) for i in old]
+        sizes = [int(np.prod(i)) for i in shapes]
+        bounds = np.cumsum([0, *sizes])
+        
+        def update(x):
+            for variable, shape, start, end in zip(variables, shapes, bounds, bounds[1:]):
+                values[variable] = x[start:end].reshape(shape) if shape else float(x[start])
+        
+        x = np.concatenate([np.ravel(i) for i in old]).astype(float)
+        for iteration in range(self.maxiter):
+            update(x)
+            residuals = self.residuals(values, functions)
+            if residuals.size != x.size:
+                raise ValueError(
+                    f"{name(self.phenomenon)} has {residuals.size} residuals "
+                    f"for {x.size} unknowns"
+                )
+            jacobian = np.empty((x.size, x.size))
+            for i in range(x.size):
+                h = self.step * max(abs(x[i]), 1.)
+                perturbed = x.copy()
+                perturbed[i] += h
+                update(perturbed)
+                jacobian[:, i] = (self.residuals(values, functions) - residuals) / h
+            dx = np.linalg.lstsq(jacobian, -residuals, rcond=None)[0]
+            x = x + dx
+            if not (np.abs(dx) > 1e-12 * np.maximum(np.abs(x), 1.)).any(): break
+        update(x)
+        return largest([max_change(i, values[j]) for i, j in zip(old, variables)])
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {name(self.phenomenon)}>"
+
+
+class PhenomenaSolver:
+    """
+    Create a PhenomenaSolver object which solves the equations of a
+    phenomenode through phenomena-based decomposition. Undirected linear
+    phenomena are grouped by category (e.g., material, energy, pressure) and
+    solved as sparse linear systems. Undirected nonlinear phenomena (e.g., 
+    the Rashford-Rice equation) are solved for their outlet variables, or 
+    for inlet variables that no other step computes, through Newton's 
+    method. Directed phenomena (e.g., bubble point and enthalpy 
+    calculations) and parameter updates are evaluated as explicit updates 
+    in between. Each iteration runs all steps in dependency order until 
+    values converge. Phenomena that none of these steps can solve (e.g.,
+    several phenomena computing the same variable) are rejected with an
+    error naming them.
+
+    Parameters
+    ----------
+    phenomenode : PhenomeNode
+        Phenomenode with leaf phenomena.
+    functions : Mapping[str, Callable], optional
+        Functions by name (e.g., 'H', 'BubblePoint'). Sums, products, and
+        minimums are built-in.
+    max_bandwidth : int, optional
+        Maximum bandwidth of linear blocks solved as banded matrices (see
+        `LinearBlock`). Defaults to 8.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> solver = phn.PhenomenaSolver(phn.StageVLE())
+    >>> [i.category for i in solver.blocks]
+    ['pressure', 'material', 'energy']
+
+    Solve a liquid-liquid extraction stage with toy property functions.
+    Explicit updates and the Rashford-Rice equation need initial guesses. 
+    The solution satisfies all equations of the stage:
+    
+    >>> import numpy as np
+    >>> from phenomenode.compiler import default_shape
+    >>> functions = {
+    ...     'H': lambda F, T, P: F.sum(-1) * (T - 300.),
+    ...     'C': lambda F, T, P: -F.sum(-1),
+    ...     'PseudoEquilibrium': lambda gamma, K, z: (np.array([4., 0.2]), gamma),
+    ... }
+    >>> stage = phn.StageLLE()
+    >>> solver = phn.PhenomenaSolver(stage, functions)
+    >>> solver.nonlinear_blocks # doctest: +ELLIPSIS
+    [<NonlinearBlock: RashfordRice(n=...)>]
+    >>> values = {i: np.ones(default_shape(i, 2)) for i in solver.inputs}
+    >>> for step in solver.steps:
+    ...     for i in step.variables: _ = values.setdefault(i, np.full(default_shape(i, 2), 0.5))
+    >>> values = solver.solve(values)
+    >>> f = phn.ResidualFunction(stage, 2, {i: values[i] for i in solver.inputs}, functions)
+    >>> bool(np.abs(f(f.pack(values))).max() < 1e-9)
+    True
+    
+    Non-finite values are never reported as converged:
+    
+    >>> values[solver.inputs[0]] = np.nan
+    >>> solver.solve(values)
+    Traceback (most recent call last):
+    FloatingPointError: <LinearBlock: pressure, 1 equations> computed non-finite values
+    
+    Phenomena that cannot be solved are rejected with an error naming them:
+    
+    >>> phn.PhenomenaSolver(phn.AggregatedStageLLE()) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ValueError: pressure block of PressureBalance(...) has 3 equations for 2 unknowns (P[o=1] is an outlet of ...)
+
+    """
+    __slots__ = ('phenomenode', 'functions', 'blocks', 'nonlinear_blocks', 
+                 'updates', 'steps')
+
+    def __init__(self, phenomenode, functions=None, max_bandwidth=8):
+        self.phenomenode = phenomenode
+        self.functions = {} if functions is None else dict(functions)
+        linear = {}
+        nonlinear = []
+        updates = []
+        for i in phenomenode.leaf_phenomena:
+            if i.directed or i.category == 'hidden':
+                updates.append(ExplicitUpdate(i))
+            elif not i.linear:
+                nonlinear.append(i)
+            elif i.category in linear:
+                linear[i.category].append(i)
+            else:
+                linear[i.category] = [i]
+        self.blocks = blocks = [LinearBlock(i, j, max_bandwidth) for i, j in linear.items()]
+        computed = set([j for i in [*blocks, *updates] for j in i.variables])
+        nonlinear_blocks = []
+        for i in nonlinear:
+            unknowns = framed_variables(i.outlet_variables()) or [
+                j for j in framed_variables(i.inlet_variables()) if j not in computed
+            ]
+            block = NonlinearBlock(i, {j: None for j in unknowns})
+            computed.update(block.variables)
+            nonlinear_blocks.append(block)
+        self.nonlinear_blocks = nonlinear_blocks
+        self.updates = updates
+        self.steps = self._sort_steps([*blocks, *nonlinear_blocks, *updates])
+
+    @staticmethod
+    def _sort_steps(steps):
+        # Depth first ordering so that steps come after the steps they
+        # depend on (except within loops).
+        producers = {}
+        for i in steps:
+            for j in i.variables: producers[j] = i
+        ordered = []
+        visited = set()
+        for root in steps:
+            if root in visited: continue
+            visited.add(root)
+            work = [(root, iter(root.inputs))]
+            while work:
+                step, inputs = work[-1]
+                for i in inputs:
+                    producer = producers.get(i)
+                    if producer is None or producer in visited: continue
+                    visited.add(producer)
+                    work.append((producer, iter(producer.inputs)))
+                    break
+                else:
+                    work.pop()
+                    ordered.append(step)
+        return ordered
+
+    @property
+    def inputs(self):
+        """[tuple[Variable]] Variables which are not computed by any step
+        and must be specified."""
+        computed = set([j for i in self.steps for j in i.variables])
+        return tuple({j: None for i in self.steps for j in i.inputs if j not in computed})
+
+    def step(self, values):
+        """Run all steps once and return the maximum relative change.
+        Raises a FloatingPointError if a step computes non-finite values."""
+        functions = self.functions
+        changes = []
+        for i in self.steps:
+            change = i.solve(values, functions)
+            if np.isnan(change): raise FloatingPointError(f"{i} computed non-finite values")
+            changes.append(change)
+        return largest(changes)
+
+    def solve(self, values, maxiter=100, tolerance=1e-6):
+        """
+        Iterate until the maximum relative change of all variables is
+        below the tolerance. Values are updated in place and returned.
+
+        Parameters
+        ----------
+        values : dict[Variable, float|ndarray]
+            Specifications and initial guesses by framed variable.
+        maxiter : int, optional
+            Maximum number of iterations. Defaults to 100.
+        tolerance : float, optional
+            Maximum relative change for convergence. Defaults to 1e-6.
+
+        """
+        for iteration in range(maxiter):
+            if self.step(values) < tolerance: return values
+        raise RuntimeError(f"{self.phenomenode} did not converge after {maxiter} iterations")
+
+    def __repr__(self):
+        return (f"<{type(self).__name__}: {len(self.blocks)} linear blocks, "
+                f"{len(self.nonlinear_blocks)} nonlinear blocks, "
+                f"{len(self.updates)} explicit updates>")
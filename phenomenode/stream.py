@@ -46,6 +46,14 @@ class Stream:
         self.dHdE = VarNode(I.dHdE)
         self.DeltaE = VarNode(I.DeltaE)
     
+    def get_state(self):
+        """Return the variable nodes of the stream."""
+        return tuple([getattr(self, i) for i in self.__slots__])
+    
+    def set_state(self, state):
+        """Set the variable nodes of the stream."""
+        for i, j in zip(self.__slots__, state): setattr(self, i, j)
+    
     def define_energy_parameter(self, name):
         for node in (self.dHdE, self.DeltaE):
             variable = node.variable
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+"""
+import numpy as np
+import multiprocessing as mp
+from itertools import product
+
+__all__ = ('grid', 'ParametricSweep')
+
+#: State of worker processes (model, function, and shared results).
+worker = None
+
+def grid(parameters):
+    """
+    Return a list of points (dictionaries of values by name) of the full
+    grid of values of each parameter.
+
+    Examples
+    --------
+    >>> import phenomenode as phn
+    >>> phn.grid({'T': [300., 350.], 'P': [101325.]})
+    [{'T': 300.0, 'P': 101325.0}, {'T': 350.0, 'P': 101325.0}]
+
+    """
+    names = tuple(parameters)
+    return [dict(zip(names, i)) for i in product(*[parameters[i] for i in names])]
+
+def initialize(factory, function, buffer, shape):
+    global worker
+    results = None if buffer is None else np.frombuffer(buffer).reshape((-1, *shape))
+    worker = (factory(), function, results)
+
+def work(task):
+    index, point = task
+    model, function, results = worker
+    value = function(model, point)
+    if results is None: return index, value
+    results[index] = value
+    return index, None
+
+
+class ParametricSweep:
+    """
+    Create a ParametricSweep object which evaluates a model at each point
+    of a grid of parameters in a pool of worker processes. Each worker
+    builds the model once (e.g., a phenomenode or a `ResidualFunction` of
+    one) and reuses it for all of its points. Points are scheduled in
+    chunks and results are returned as they complete.
+
+    Unless workers are forked, the factory and function are pickled by
+    reference, so they must be module-level functions or other picklable 
+    callables (not lambdas or nested functions). The 'spawn' start method
+    (the default on Windows and macOS) also imports the main module in 
+    each worker, so scripts must start sweeps under an 
+    ``if __name__ == '__main__':`` guard.
+
+    Parameters
+    ----------
+    factory : Callable[[], Any]
+        Returns the model.
+    function : Callable[[Any, Any], Any]
+        Returns the result of the model at a point.
+    processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    chunksize : int, optional
+        Number of points sent to a worker at a time. Defaults to splitting
+        the points into 4 chunks per worker.
+    maxtasksperchild : int, optional
+        Number of chunks after which a worker is replaced with a new one,
+        releasing memory held by the model. Defaults to never.
+    shape : tuple[int], optional
+        Shape of results. If given, results are arrays of floats which
+        workers write into a shared memory buffer instead of sending them
+        back through pipes.
+    start_method : str, optional
+        Start method of worker processes ('spawn', 'fork', or 'forkserver';
+        see `multiprocessing.get_context`). Defaults to the default start
+        method of the platform.
+
+    Examples
+    --------
+    A script that counts the leaf phenomena of columns with 2 to 4 stages
+    in spawned workers:
+    
+    .. code-block:: python
+    
+        import phenomenode as phn
+        
+        def build():
+            return phn.MultiStageVLE(n_stages=4)
+        
+        def count_leaves(unit, point):
+            return sum([len(i.leaf_phenomena) for i in unit.vle_stages[:point['n']]])
+        
+        if __name__ == '__main__':
+            sweep = phn.ParametricSweep(build, count_leaves, start_method='spawn')
+            print(sweep.run(phn.grid({'n': [2, 3, 4]})))
+    
+    Callables from importable modules can be used as they are:
+    
+    >>> import phenomenode as phn
+    >>> from functools import partial
+    >>> sweep = phn.ParametricSweep(
+    ...     partial(phn.MultiStageVLE, n_stages=2), getattr,
+    ...     processes=2, start_method='spawn',
+    ... )
+    >>> sweep.run(['n_stages', 'feed_stages'])
+    [2, (0, -1)]
+    
+    Results with a shape are written into shared memory and stacked:
+    
+    >>> import numpy as np
+    >>> sweep = phn.ParametricSweep(
+    ...     partial(np.arange, 3.), np.multiply, 
+    ...     processes=1, shape=(3,), start_method='spawn',
+    ... )
+    >>> sweep.run([1., 2.])
+    array([[0., 1., 2.],
+           [0., 2., 4.]])
+
+    """
+    __slots__ = ('factory', 'function', 'processes', 'chunksize', 
+                 'maxtasksperchild', 'shape', 'start_method')
+
+    def __init__(self, factory, function, processes=None, chunksize=None,
+                 maxtasksperchild=None, shape=None, start_method=None):
+        self.factory = factory
+        self.function = function
+        self.processes = mp.cpu_count() if processes is None else processes
+        self.chunksize = chunksize
+        self.maxtasksperchild = maxtasksperchild
+        self.shape = None if shape is None else tuple(shape)
+        self.start_method = start_method
+
+    def imap(self, points):
+        """Yield the index and result of each point in order of
+        completion."""
+        points = list(points)
+        n_points = len(points)
+        if not n_points: return
+        chunksize = self.chunksize
+        if chunksize is None: chunksize = max(1, -(-n_points // (4 * self.processes)))
+        shape = self.shape
+        context = mp.get_context(self.start_method)
+        if shape is None:
+            buffer = results = None
+        else:
+            buffer = context.RawArray('d', n_points * int(np.prod(shape)))
+            results = np.frombuffer(buffer).reshape((n_points, *shape))
+        pool = context.Pool(
+            min(self.processes, -(-n_points // chunksize)),
+            initialize, (self.factory, self.function, buffer, shape),
+            self.maxtasksperchild,
+        )
+        try:
+            for index, value in pool.imap_unordered(work, enumerate(points), chunksize):
+                yield index, value if results is None else results[index].copy()
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def run(self, points):
+        """Return the results of all points in order (stacked as an array if
+        results have a shape)."""
+        points = list(points)
+        results = [None] * len(points)
+        for index, value in self.imap(points): results[index] = value
+        if self.shape is not None: results = np.array(results).reshape((len(points), *self.shape))
+        return results
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self.processes} processes>"
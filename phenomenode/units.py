@@ -211,8 +211,8 @@ class StageLLE(PhenomeNode, tag='s'):
                 extract.P = Rfeed.P
             else:
                 Efeed, Rfeed, *others = ins
-                extract.P = Efeed.P
-                raffinate.P = Rfeed.P
+                extract.P = Rfeed.P
+                raffinate.P = Efeed.P
         elif location == 'bottom':
             Rfeed, *others = ins
             extract.P = Rfeed.P
@@ -547,15 +547,16 @@ class MultiStageVLE(PhenomeNode, tag='v'):
         stage_location = {0: 'top', n_stages-1: 'bottom'}
         abstract_parameters = self.abstract_parameters
         adiabatic = self.adiabatic
-        self.vle_stages = [
-            StageVLE(
-                ins=inlet_streams[i],
-                outs=outlet_streams[i],
+        self.vle_stages = stages = []
+        for i in range(n_stages):
+            ins = inlet_streams[i]
+            kwargs = dict(
                 location=stage_location.get(i, 'middle'),
                 abstract_parameters=abstract_parameters,
                 adiabatic=adiabatic or (i!=0) or (i==n_stages-1)
-            ) for i in range(n_stages)
-        ]
+            )
+            stage = StageVLE(ins, outlet_streams[i], **kwargs)
+            stages.append(stage)
         
 class MultiStageLLE(PhenomeNode, tag='e'):
     n_ins = 2
@@ -591,14 +592,17 @@ class MultiStageLLE(PhenomeNode, tag='e'):
             if i in feeds_by_stage:
                 inlets.extend(feeds_by_stage[i])
             inlet_streams.append(inlets)
+        stage_location = {0: 'top', n_stages-1: 'bottom'}
         abstract_parameters = self.abstract_parameters
-        self.lle_stages = [
-            StageLLE(
-                ins=inlet_streams[i],
-                outs=outlet_streams[i],
+        self.lle_stages = stages = []
+        for i in range(n_stages):
+            ins = inlet_streams[i]
+            kwargs = dict(
+                location=stage_location.get(i, 'middle'),
                 abstract_parameters=abstract_parameters,
-            ) for i in range(n_stages)
-        ]
+            )
+            stage = StageLLE(ins, outlet_streams[i], **kwargs)
+            stages.append(stage)
             
 # class Split(Node):
 #     n_ins = 1
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 """
 """
+import sys
+from weakref import ref as ref_to
+from threading import Lock, get_ident
 
-__all__ = ('AbstractMethod',)
+__all__ = ('AbstractMethod', 'InternTable', 'get_owner')
 
 class AbstractMethodType:
     __slots__ = ()
@@ -14,4 +17,67 @@ class AbstractMethodType:
     def __bool__(self): return False
     def __repr__(self): return "AbstractMethod"
 
-AbstractMethod = object.__new__(AbstractMethodType)
\ No newline at end of file
+AbstractMethod = object.__new__(AbstractMethodType)
+
+def get_owner():
+    """
+    Return the identity of the current thread and asyncio task (if any). 
+    State held in context variables is copied the first time it is used by 
+    a new owner, so that threads and tasks which inherit a context do not
+    share mutable state.
+    
+    """
+    asyncio = sys.modules.get('asyncio') # No tasks unless asyncio is imported
+    if asyncio is not None:
+        # Check for a running loop first; raising from `current_task` 
+        # outside of a loop is slow and this is called on every build step
+        loop = asyncio._get_running_loop()
+        if loop is not None: return (get_ident(), asyncio.current_task(loop))
+    return (get_ident(), None)
+
+class InternTable:
+    """
+    Create an InternTable object which maps keys to weakly referenced 
+    objects. Entries of garbage collected objects are purged whenever the 
+    table doubles in size, so that the cost of purging is amortized. 
+    Insertions and purges are thread-safe.
+    
+    """
+    __slots__ = ('refs', 'purge_size', 'lock')
+    
+    def __init__(self):
+        self.refs = {}
+        self.purge_size = 1024
+        self.lock = Lock()
+    
+    def get(self, key):
+        ref = self.refs.get(key)
+        if ref is not None: return ref()
+    
+    def setdefault(self, key, obj):
+        """Intern object unless another live object is already interned by 
+        the same key; return the interned object."""
+        with self.lock:
+            refs = self.refs
+            ref = refs.get(key)
+            if ref is not None:
+                other = ref()
+                if other is not None: return other
+            refs[key] = ref_to(obj)
+            if len(refs) > self.purge_size: self._purge()
+        return obj
+    
+    def purge(self):
+        """Discard entries of garbage collected objects."""
+        with self.lock: self._purge()
+    
+    def _purge(self):
+        refs = self.refs
+        for key in [i for i, j in refs.items() if j() is None]: del refs[key]
+        self.purge_size = max(2 * len(refs), 1024)
+    
+    def __len__(self):
+        return len(self.refs)
+    
+    def __repr__(self):
+        return f"{type(self).__name__}(<{len(self)} entries>)"
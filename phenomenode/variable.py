@@ -3,7 +3,8 @@
 """
 import phenomenode as phn
 from types import MappingProxyType
-from .context import ContextStack, ContextItem, ContextFamily, Chemical, Phase, Inlet, Outlet
+from .utils import InternTable
+from .context import context_key, ContextStack, ContextItem, ContextFamily, Chemical, Phase, Inlet, Outlet
 from .quantity import Quantity
 from .preferences import preferences
 
@@ -12,12 +13,42 @@ __all__ = (
 )
 
 class Variable(Quantity):
+    """
+    Create an immutable variable. Variables are interned, so variables with 
+    the same name and structurally identical contexts (see `context_key`) 
+    are the same object and equality reduces to an identity check. Highlight
+    is not part of the identity of a variable; the highlight of the first
+    variable created is kept.
+    
+    """
     __slots__ = ('name', 'context', '_hash', 'highlight')
     
-    def __init__(self, name, context=None, highlight=None):
-        self.name = name
-        self.context = ContextStack() if context is None else context
-        self.highlight = highlight
+    #: [InternTable] Interned variables by name and context key.
+    interned = InternTable()
+    
+    def __new__(cls, name, context=None, highlight=None):
+        if context is None: 
+            context = ContextStack()
+        elif isinstance(context, (list, tuple)):
+            context = ContextStack.from_tuple(tuple(context))
+        key = (cls, name, context_key(context))
+        interned = cls.interned
+        self = interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            setattr = object.__setattr__
+            setattr(self, 'name', name)
+            setattr(self, 'context', context)
+            setattr(self, 'highlight', highlight)
+            setattr(self, '_hash', hash(key))
+            self = interned.setdefault(key, self)
+        return self
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("variables are immutable")
+    
+    def __reduce__(self):
+        return self.__class__, (self.name, self.context, self.highlight)
         
     def __call__(self, *args):
         return FunctionCall(self, args)
@@ -53,16 +84,10 @@ class Variable(Quantity):
             raise TypeError('index must be a context')
             
     def __hash__(self):
-        try:
-            return self._hash
-        except:
-            self._hash = hash(
-                (self.name, self.context)
-            )
-            return self._hash
+        return self._hash
         
     def __eq__(self, other):
-        return format(self, 'n') == format(other, 'n')
+        return self is other
         
     def __repr__(self):
         return f"{type(self).__name__}({self.name!r}, {self.context!r})"
@@ -1,47 +1,80 @@
 # -*- coding: utf-8 -*-
 """
 """
-from .context import Outlet, Inlet
+from .context import Outlet, Inlet, ContextStack
 from collections import deque
+from itertools import count
 import phenomenode as phn
 
 __all__ = ('VarNode',)
 
+#: [count] Versions of phenomena graphs. Versions are unique across graphs, 
+#: so caches are also invalidated when a phenomenode is nested in another.
+graph_versions = count(1)
+
 class VarNode:
-    __slots__ = ('variable', 'sources', 'sinks', 'variable', '_number')
-        
+    __slots__ = ('_variable', 'sources', 'sinks', '_context_cache')
+    
     def __init__(self, variable, sources=None, sinks=None):
         self.sources = deque() if sources is None else deque(sources)
         self.sinks = deque() if sinks is None else deque(sinks)
         self.variable = variable
     
+    @property
+    def graph_version(self):
+        """[int] Version of the phenomena graph of the parent phenomenon 
+        (0 if the variable node is not connected)."""
+        parent = self.parent
+        return 0 if parent is None else parent.graph_version
+    
+    def graph_changed(self):
+        """Invalidate cached numbering and contexts of the phenomena graphs
+        this variable node is connected to."""
+        for i in self.sources: i.graph_changed()
+        for i in self.sinks: i.graph_changed()
+    
+    @property
+    def variable(self):
+        return self._variable
+    @variable.setter
+    def variable(self, variable):
+        self._variable = variable
+        self._context_cache = None
+        self.graph_changed()
+    
+    @property
+    def parent(self):
+        sources = self.sources
+        if sources: return sources[-1]
+        sinks = self.sinks
+        if sinks: return sinks[-1]
+    
     @property
     def number(self):
-        try:
-            return self._number
-        except:
-            parent = (
-                (self.sources and self.sources[-1])
-                or (self.sinks and self.sinks[-1])
-            )
-            if not parent: return None
-            ancestor = parent.ancestry[-1]
-            if ancestor.phenomena:
-                varnodes = sum([i.varnodes for i in ancestor.nested_phenomena if not i.phenomena], [])
-            else:
-                varnodes = ancestor.varnodes
-            varnode_set = set()
-            n = 0
-            variable = self.variable
-            for i in varnodes:
-                if i in varnode_set: continue
-                if i.variable == variable and not any([j.phenomena for j in (*i.sources, *i.sinks)]): 
-                    i._number = n
-                    n += 1
-                varnode_set.add(i)
-            if n <= 1: self._number = None
-            return self._number
+        parent = self.parent
+        if parent is None: return None
+        return parent.ancestry[-1].get_varnode_numbers().get(self)
             
+    @property
+    def tag_path(self):
+        """[str] Identifier of the variable node by the tag path of its 
+        parent phenomenon and its port (e.g., 'm0_s2_e5_o1' for the second
+        outlet of a phenomenon)."""
+        sources = self.sources
+        if sources:
+            parent = sources[-1]
+            port = 'o'
+            varnodes = parent.outs.varnodes
+        else:
+            sinks = self.sinks
+            if not sinks: return f"v{id(self)}"
+            parent = sinks[-1]
+            port = 'i'
+            varnodes = parent.ins.varnodes
+        for n, i in enumerate(varnodes):
+            if i is self: return f"{parent.tag_path}_{port}{n}"
+        return f"v{id(self)}"
+    
     @property
     def sink(self):
         sinks = self.sinks
@@ -59,8 +92,8 @@ class VarNode:
     def label(self):
         return self.get_tooltip_string('n')
     
-    def vizoptions(self):
-        tooltip = self.get_tooltip_string(phn.preferences.label_format)
+    def vizoptions(self, tooltip=None):
+        if tooltip is None: tooltip = self.get_tooltip_string(phn.preferences.label_format)
         color = '#b4b1ae'
         # color = phn.PhenomeNodeGraphics.colors[variable_categories[self.variable.name]]
         options = {
@@ -77,19 +110,39 @@ class VarNode:
             'style': 'filled',
             'color': color,
             'label': tooltip if phn.preferences.label_nodes else '',
-            'name': str(hash(self)),
+            'name': self.tag_path,
         }
         if phn.preferences.tooltip: options['tooltip'] = tooltip
         # if 'texlbl' not in options:
         #     options['texlbl'] = self.get_tooltip_string('l')
         return options
     
+    def _get_context_cache(self):
+        version = self.graph_version
+        cache = self._context_cache
+        if cache is not None and cache[0] == version: return cache
+        context = self._resolve_full_context()
+        cache = self._context_cache = (
+            version, context, self.variable.framed(context)
+        )
+        return cache
+    
     def get_full_context(self):
+        """Return the context of the variable node within the hierarchy of 
+        phenomena. Results are cached until the graph changes."""
+        return self._get_context_cache()[1]
+    
+    def get_framed_variable(self):
+        """Return the variable framed by its full context. Results are 
+        cached until the graph changes."""
+        return self._get_context_cache()[2]
+    
+    def _resolve_full_context(self):
         sources = self.sources
         sinks = self.sinks
         if sources:
             for source in sources:
-                if source.phenomena: 
+                if source.has_phenomena: 
                     unit = True
                     break
             else:
@@ -98,19 +151,19 @@ class VarNode:
             if unit:
                 for n, i in enumerate(source.outs):
                     if self in i.varnodes: break
-                context = Outlet(n) + source.ancestry[:-1]
+                context = ContextStack(Outlet(n), *source.ancestry[:-1])
             else:
                 if len(source.ancestry) > 1:
                     n = self.number
                     if n is None:
-                        context = source.ancestry[1:-1]
+                        context = ContextStack.from_tuple(tuple(source.ancestry[1:-1]))
                     else:
-                        context = phn.Number(n) + source.ancestry[1:-1]
+                        context = ContextStack(phn.Number(n), *source.ancestry[1:-1])
                 else:
                     context = None
         elif sinks:
             for sink in sinks:
-                if sink.phenomena: 
+                if sink.has_phenomena: 
                     unit = True
                     break
             else:
@@ -119,14 +172,14 @@ class VarNode:
             if unit:
                 for n, i in enumerate(sink.ins):
                     if self in i.varnodes: break
-                context = Inlet(n) + sink.ancestry[:-1]
+                context = ContextStack(Inlet(n), *sink.ancestry[:-1])
             else:
                 if len(sink.ancestry) > 1:
                     n = self.number
                     if n is None:
-                        context = sink.ancestry[1:-1]
+                        context = ContextStack.from_tuple(tuple(sink.ancestry[1:-1]))
                     else:
-                        context = phn.Number(n) + sink.ancestry[1:-1]
+                        context = ContextStack(phn.Number(n), *sink.ancestry[1:-1])
                 else:
                     context = None
             
@@ -136,13 +189,7 @@ class VarNode:
     
     def get_tooltip_string(self, fmt=None):
         if fmt is None: fmt = phn.preferences.context_format
-        label = format(
-            self.variable.framed(
-                context=self.get_full_context()
-            ),
-            fmt
-        )
-        return label
+        return format(self.get_framed_variable(), fmt)
     
     __str__ = label
     